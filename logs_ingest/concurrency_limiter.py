@@ -0,0 +1,78 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import time
+from typing import Optional
+
+OVERLOAD_STATUSES = (413, 429)
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.2
+MIN_LATENCY_SAMPLES = 5
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the number of concurrent requests with AIMD (additive increase, multiplicative decrease):
+    the limit grows by one after each window of 'limit' healthy responses and is halved when Dynatrace throttles (413, 429),
+    fails (5xx, connection errors) or when latency rises above LATENCY_TOLERANCE times the average of healthy responses.
+    Only the first overload signal is acted upon - responses to requests started before the last decrease are ignored,
+    so a burst of throttled requests halves the limit once.
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int, max_limit: int):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._healthy_responses = 0
+        self._last_decrease_time = 0.0
+        self._average_latency: Optional[float] = None
+        self._latency_samples = 0
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_response(self, status: int, request_start_time: float):
+        """request_start_time is taken right before sending the request, so that latency covers only the request itself"""
+        latency = time.perf_counter() - request_start_time
+        if status in OVERLOAD_STATUSES or status >= 500 or self._is_latency_rising(latency):
+            self.on_failure(request_start_time)
+            return
+
+        self._average_latency = latency if self._average_latency is None \
+            else (1 - LATENCY_SMOOTHING) * self._average_latency + LATENCY_SMOOTHING * latency
+        self._latency_samples += 1
+        self._healthy_responses += 1
+        if self._healthy_responses >= self.limit:
+            self._healthy_responses = 0
+            self.limit = min(self.limit + 1, self.max_limit)
+
+    def on_failure(self, request_start_time: float):
+        if request_start_time < self._last_decrease_time:
+            return
+        self._healthy_responses = 0
+        self._last_decrease_time = time.perf_counter()
+        self.limit = max(self.limit // 2, self.min_limit)
+
+    def _is_latency_rising(self, latency: float) -> bool:
+        return self._latency_samples >= MIN_LATENCY_SAMPLES and latency > LATENCY_TOLERANCE * self._average_latency
@@ -12,87 +12,335 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import atexit
 import gzip
-import json
 import os
+import queue
+import random
 import ssl
+import threading
 import time
+import zlib
 import aiohttp
 import asyncio
 
-from typing import List, Dict, Tuple, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Dict, Tuple, NamedTuple, Iterable, Iterator, Optional, Mapping, Callable, Awaitable, Union, AsyncIterator
 from urllib.error import HTTPError
 from urllib.parse import urlparse
 
 from logs_ingest.self_monitoring import SelfMonitoring, DynatraceConnectivity
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
 from .util.util_misc import get_int_environment_value
-from . import logging
+from . import json_codec, logging
 
 should_verify_ssl_certificate = os.environ.get("REQUIRE_VALID_CERTIFICATE", "True") in ["True", "true"]
 
 number_of_concurrent_send_calls = get_int_environment_value("NUMBER_OF_CONCURRENT_SEND_CALLS", 2)
+min_concurrent_send_calls = get_int_environment_value("MIN_CONCURRENT_SEND_CALLS", 1)
+max_concurrent_send_calls = get_int_environment_value("MAX_CONCURRENT_SEND_CALLS", max(10, number_of_concurrent_send_calls))
+compression_level = min(get_int_environment_value("COMPRESSION_LEVEL", 6), 9)
+streaming_compression_enabled = os.environ.get("STREAMING_COMPRESSION_ENABLED", "False") in ["True", "true"]
+number_of_compression_threads = get_int_environment_value("NUMBER_OF_COMPRESSION_THREADS", number_of_concurrent_send_calls) or 1
+# zlib releases the GIL, so batches compressed in the pool don't block the event loop sending other batches
+compression_executor = ThreadPoolExecutor(max_workers=number_of_compression_threads, thread_name_prefix="logs-compression")
+# requests waiting in the connector for a connection would look like rising latency to the concurrency limiter
+connection_pool_size = get_int_environment_value("CONNECTION_POOL_SIZE", max_concurrent_send_calls)
+connection_keep_alive_timeout = get_int_environment_value("CONNECTION_KEEP_ALIVE_TIMEOUT", 30)
+dns_cache_ttl = get_int_environment_value("DNS_CACHE_TTL", 300)
+parsing_thread_enabled = os.environ.get("PARSING_THREAD_ENABLED", "False") in ["True", "true"]
+parsed_batches_queue_size = get_int_environment_value("PARSED_BATCHES_QUEUE_SIZE", number_of_concurrent_send_calls) or 1
+number_of_parsing_threads = get_int_environment_value("NUMBER_OF_PARSING_THREADS", 2) or 1
+parsing_executor = ThreadPoolExecutor(max_workers=number_of_parsing_threads, thread_name_prefix="logs-parsing")
 ssl_context = ssl.create_default_context()
 if not should_verify_ssl_certificate:
     ssl_context.check_hostname = False
     ssl_context.verify_mode = ssl.CERT_NONE
 
 
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BASE_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 10
+PARSED_BATCH_PUT_TIMEOUT = 0.1
+
+# Event loop, ClientSession and concurrency limit of the thread running the function, kept between executions
+_sender_state = threading.local()
+# Current session of each thread, closed at exit
+_thread_sessions: Dict[int, Tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]] = {}
+
+
 class LogBatch(NamedTuple):
-    serialized_batch: str
+    serialized_batch: bytearray  # gzip stream if compressed
     number_of_logs_in_batch: int
+    uncompressed_size: int
+    compressed: bool = False
+
+
+class BatchBuilder:
+    """
+    Builds the request body (JSON array of log entries) directly in a byte buffer,
+    so that every log entry is serialized and encoded only once and the batch size is known exactly.
+    With compression enabled entries are fed to a gzip compressor as they are added, and only compressed body is kept.
+    """
+
+    def __init__(self, request_body_max_size: int, request_max_events: int, compress: bool = False):
+        self.request_body_max_size = request_body_max_size
+        self.request_max_events = request_max_events
+        self.number_of_logs = 0
+        self.size = 0
+        self._buffer = bytearray()
+        # wbits=31 makes zlib write gzip header and trailer
+        self._compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 31) if compress else None
+        self._append(b"[")
+
+    def fits(self, serialized_log_entry: bytes) -> bool:
+        if self.number_of_logs >= self.request_max_events:
+            return False
+        separator_size = 1 if self.number_of_logs else 0
+        return self.size + separator_size + len(serialized_log_entry) + 1 <= self.request_body_max_size  # +1 is for closing bracket
+
+    def add(self, serialized_log_entry: bytes):
+        if self.number_of_logs:
+            self._append(b",")
+        self._append(serialized_log_entry)
+        self.number_of_logs += 1
+
+    def close(self) -> LogBatch:
+        self._append(b"]")
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+        return LogBatch(self._buffer, self.number_of_logs, self.size, self._compressor is not None)
+
+    def _append(self, data: bytes):
+        self.size += len(data)
+        self._buffer += self._compressor.compress(data) if self._compressor else data
+
+
+def run_in_sender_loop(coroutine):
+    """
+    Runs the coroutine on the event loop of the calling thread. Unlike asyncio.run the loop is not closed afterwards,
+    so the next execution handled by the same thread reuses the ClientSession together with its keep-alive connections
+    and DNS cache, instead of resolving and handshaking with the ActiveGate again.
+    """
+    loop = getattr(_sender_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _sender_state.loop = loop
+    return loop.run_until_complete(coroutine)
+
+
+def _get_session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = getattr(_sender_state, "session", None)
+    if session is None or session.closed or getattr(_sender_state, "session_loop", None) is not loop:
+        connector = aiohttp.TCPConnector(limit=connection_pool_size, keepalive_timeout=connection_keep_alive_timeout,
+                                         ttl_dns_cache=dns_cache_ttl)
+        session = aiohttp.ClientSession(connector=connector)
+        _sender_state.session = session
+        _sender_state.session_loop = loop
+        _thread_sessions[threading.get_ident()] = (loop, session)
+    return session
+
+
+@atexit.register
+def _close_sessions():
+    for loop, session in list(_thread_sessions.values()):
+        if not session.closed and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(session.close())
+
+
+async def send_logs(dynatrace_url: str, dynatrace_token: str, logs: Iterable[Union[Dict, bytes]], self_monitoring: SelfMonitoring):
+    log_ingest_url = urlparse(dynatrace_url.rstrip("/") + "/api/v2/logs/ingest").geturl()
+    start_time = None
+    batch_exceptions: List[Exception] = []
+    # failed batches are retried in place until the budget runs out, only then the execution fails and is retried by the host
+    retry_time_budget = get_int_environment_value("DYNATRACE_LOG_INGEST_RETRY_TIME_BUDGET", 30)
+
+    # Limit adapted during previous execution in this thread is the starting point
+    concurrency_limiter = AdaptiveConcurrencyLimiter(getattr(_sender_state, "concurrency_limit", number_of_concurrent_send_calls),
+                                                     min_concurrent_send_calls, max_concurrent_send_calls)
+    session = _get_session()  # Reused by following executions in this thread, with its open connections
+
+    async def process_batch(batch: LogBatch):
+        display_payload_size = round((batch.uncompressed_size / 1024), 3)
+        logging.info(f'Log ingest payload size: {display_payload_size} kB')
+        sent_logs_successfully = False
+        try:
+            encoded_body_bytes = await _compress_batch(batch)
+            status = await _send_with_retries(
+                lambda: _send_logs(session, dynatrace_token, encoded_body_bytes, log_ingest_url, self_monitoring),
+                concurrency_limiter, retry_time_budget, self_monitoring)
+            sent_logs_successfully = status <= 299
+        except HTTPError as e:
+            raise e
+        except Exception as e:
+            self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.Other)
+            batch_exceptions.append(e)
+            logging.exception("Failed to ingest logs", "ingesting-logs-exception")
+        finally:
+            await concurrency_limiter.release()
+            self_monitoring.sending_time = time.perf_counter() - start_time
+            if sent_logs_successfully:
+                self_monitoring.log_ingest_payload_size += display_payload_size
+                self_monitoring.sent_log_entries += batch.number_of_logs_in_batch
+
+    tasks = []
+    try:
+        # Batches are sent as soon as they are closed, the limiter keeps at most max_concurrent_send_calls of them in memory
+        async with aclosing(_iterate_batches_parsed_in_thread(logs) if parsing_thread_enabled else _iterate_batches(logs)) as batches:
+            async for batch in batches:
+                await concurrency_limiter.acquire()
+                if start_time is None:
+                    start_time = time.perf_counter()
+                tasks.append(asyncio.create_task(process_batch(batch)))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        await _cancel_tasks(tasks)
+        raise
+    finally:
+        _sender_state.concurrency_limit = concurrency_limiter.limit
+        self_monitoring.concurrent_send_calls_limit = concurrency_limiter.limit
+
+    # all http requests failed, raise the exception to trigger retry
+    if batch_exceptions and len(batch_exceptions) == len(tasks):
+        raise batch_exceptions[-1]
+
+
+async def _cancel_tasks(tasks: List[asyncio.Task]):
+    # the loop is kept for next executions, don't leave requests of the remaining batches running on it
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _iterate_batches(logs: Iterable[Union[Dict, bytes]]) -> AsyncIterator[LogBatch]:
+    for batch in iterate_serialized_batches(logs):
+        yield batch
+        # let the task created for the batch start its request before parsing further logs
+        await asyncio.sleep(0)
+
+
+async def _iterate_batches_parsed_in_thread(logs: Iterable[Union[Dict, bytes]]) -> AsyncIterator[LogBatch]:
+    """
+    Logs are parsed and batched in a thread of parsing_executor, while the event loop sends the batches closed so far.
+    Parsing waits when parsed_batches_queue_size batches are ready and not sent yet, so only a few batches are kept in memory.
+    The queue doesn't depend on the event loop running, so when sending stops early the parsing thread stops as well,
+    and it has finished before the batches stop being iterated.
+    """
+    loop = asyncio.get_running_loop()
+    batches_queue: queue.Queue = queue.Queue(maxsize=parsed_batches_queue_size)
+    batch_ready = asyncio.Event()
+    stopped = threading.Event()
+    parsing = loop.run_in_executor(parsing_executor, _put_batches_to_queue, logs, batches_queue,
+                                   lambda: loop.call_soon_threadsafe(batch_ready.set), stopped)
+    try:
+        while True:
+            # cleared before checking the queue, so that a batch put in the meantime sets it again
+            batch_ready.clear()
+            try:
+                batch = batches_queue.get_nowait()
+            except queue.Empty:
+                await batch_ready.wait()
+                continue
+            if batch is None:
+                break
+            yield batch
+        await parsing  # raises the exception which ended parsing, if any
+    finally:
+        stopped.set()
+        # parsing thread notices it's stopped within PARSED_BATCH_PUT_TIMEOUT or once it finishes the batch being built
+        await asyncio.gather(parsing, return_exceptions=True)
+
+
+def _put_batches_to_queue(logs: Iterable[Union[Dict, bytes]], batches_queue: queue.Queue, notify_batch_ready: Callable[[], None],
+                          stopped: threading.Event):
+    batches = iterate_serialized_batches(logs)
+    try:
+        while not stopped.is_set():
+            batch = next(batches, None)
+            if not _put_to_queue(batch, batches_queue, notify_batch_ready, stopped) or batch is None:
+                return
+    except BaseException:
+        # None marks the end of batches, the exception is raised by the parsing future
+        _put_to_queue(None, batches_queue, notify_batch_ready, stopped)
+        raise
+
+
+def _put_to_queue(batch: Optional[LogBatch], batches_queue: queue.Queue, notify_batch_ready: Callable[[], None],
+                  stopped: threading.Event) -> bool:
+    while not stopped.is_set():
+        try:
+            batches_queue.put(batch, timeout=PARSED_BATCH_PUT_TIMEOUT)
+        except queue.Full:
+            continue
+        notify_batch_ready()
+        return True
+    return False
+
+
+async def _send_with_retries(send_request: Callable[[], Awaitable[int]], concurrency_limiter: AdaptiveConcurrencyLimiter,
+                             retry_time_budget: float, self_monitoring: SelfMonitoring) -> int:
+    attempt = 0
+    retry_deadline = None
+    stale_connection_retried = False
+    while True:
+        # latency is measured from here, waiting for the limiter or compression isn't a sign of Dynatrace slowing down
+        request_start_time = time.perf_counter()
+        try:
+            status = await send_request()
+        except HTTPError as e:
+            concurrency_limiter.on_response(e.code, request_start_time)
+            # budget of the batch is counted from its first failure, time spent parsing before doesn't use it up
+            if retry_deadline is None:
+                retry_deadline = time.perf_counter() + retry_time_budget
+            retry_delay = _get_retry_delay(e, attempt, retry_deadline)
+            if retry_delay is None:
+                raise e
+            logging.info(f"Retrying log ingest request in {round(retry_delay, 3)} s")
+            self_monitoring.retried_requests += 1
+            # the slot is kept while waiting, so throttling slows down sending and parsing of further batches
+            await asyncio.sleep(retry_delay)
+            attempt += 1
+            continue
+        except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError) as e:
+            # keep-alive connection reused from the pool may have been closed by the server in the meantime
+            if stale_connection_retried:
+                concurrency_limiter.on_failure(request_start_time)
+                raise e
+            stale_connection_retried = True
+            logging.info(f"Retrying log ingest request after connection error: {e}")
+            self_monitoring.retried_requests += 1
+            continue
+        except Exception as e:
+            concurrency_limiter.on_failure(request_start_time)
+            raise e
+        concurrency_limiter.on_response(status, request_start_time)
+        return status
+
+
+async def _compress_batch(batch: LogBatch) -> bytes:
+    encoded_body_bytes = batch.serialized_batch
+    if not batch.compressed:
+        encoded_body_bytes = await asyncio.get_running_loop().run_in_executor(compression_executor, gzip.compress, encoded_body_bytes,
+                                                                              compression_level)
+    compressed_size_kb = len(encoded_body_bytes) / 1024.0
 
+    logging.info(f'Log ingest payload size compressed: {compressed_size_kb} kB')
+    return encoded_body_bytes
 
-async def send_logs(dynatrace_url: str, dynatrace_token: str, logs: List[Dict], self_monitoring: SelfMonitoring):
-    start_time = time.perf_counter()
-    log_ingest_url = urlparse(dynatrace_url.rstrip("/") + "/api/v2/logs/ingest").geturl()
-    batches = prepare_serialized_batches(logs)
-    number_of_http_errors = 0
-
-    semaphore = asyncio.Semaphore(number_of_concurrent_send_calls)
-    async with aiohttp.ClientSession() as session:  # Create the session once
-        async def process_batch(batch: LogBatch):
-            nonlocal number_of_http_errors
-            async with semaphore:
-                encoded_body_bytes = batch.serialized_batch.encode("UTF-8")
-                display_payload_size = round((len(encoded_body_bytes) / 1024), 3)
-                logging.info(f'Log ingest payload size: {display_payload_size} kB')
-                sent_logs_successfully = False
-                try:
-                    sent_logs_successfully = await _send_logs(session, dynatrace_token, encoded_body_bytes,
-                                                              log_ingest_url, self_monitoring)
-                except HTTPError as e:
-                    raise e
-                except Exception as e:
-                    self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.Other)
-                    number_of_http_errors += 1
-                    logging.exception("Failed to ingest logs", "ingesting-logs-exception")
-                    # # all http requests failed and this is the last batch, raise this exception to trigger retry
-                    if number_of_http_errors == len(batches):
-                        raise e
-                finally:
-                    self_monitoring.sending_time = time.perf_counter() - start_time
-                    if sent_logs_successfully:
-                        self_monitoring.log_ingest_payload_size += display_payload_size
-                        self_monitoring.sent_log_entries += batch.number_of_logs_in_batch
-
-        await asyncio.gather(*[process_batch(batch) for batch in batches])
-
-
-async def _send_logs(session, dynatrace_token, encoded_body_bytes, log_ingest_url, self_monitoring):
+
+async def _send_logs(session, dynatrace_token, encoded_body_bytes, log_ingest_url, self_monitoring) -> int:
     self_monitoring.all_requests += 1
-    is_request_successful = False
     headers = {
         "Authorization": f"Api-Token {dynatrace_token}",
         "Content-Type": "application/json; charset=utf-8",
         "Content-Encoding": "gzip"
     }
 
-    encoded_body_bytes = gzip.compress(encoded_body_bytes, compresslevel=6)
-    compressed_size_kb = len(encoded_body_bytes) / 1024.0
-
-    logging.info(f'Log ingest payload size compressed: {compressed_size_kb} kB')
-
-    status, reason, response = await _perform_http_request(
+    status, reason, response, response_headers = await _perform_http_request(
         session,
         method="POST",
         url=log_ingest_url,
@@ -114,68 +362,80 @@ async def _send_logs(session, dynatrace_token, encoded_body_bytes, log_ingest_ur
             self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.WrongURL)
         elif status in (413, 429):
             self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.TooManyRequests)
-            raise HTTPError(log_ingest_url, 429, "Dynatrace throttling response", "", "")
-        elif status == 500:
+            raise HTTPError(log_ingest_url, status, "Dynatrace throttling response", response_headers, None)
+        elif status in (500, 502, 503, 504):
             self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.Other)
-            raise HTTPError(log_ingest_url, 500, "Dynatrace server error", "", "")
+            raise HTTPError(log_ingest_url, status, "Dynatrace server error", response_headers, None)
     else:
-        is_request_successful = True
         self_monitoring.dynatrace_connectivities.append(DynatraceConnectivity.Ok)
         logging.info("Log ingest payload pushed successfully")
-    return is_request_successful
+    return status
 
 
-
-async def _perform_http_request(session, method, url, encoded_body_bytes, headers) -> Tuple[int, str, str]:
+async def _perform_http_request(session, method, url, encoded_body_bytes, headers) -> Tuple[int, str, str, Mapping[str, str]]:
     timeout = aiohttp.ClientTimeout(total=10)
     async with session.request(method, url, headers=headers, data=encoded_body_bytes, ssl=ssl_context, timeout=timeout) as response:
         response_text = await response.text()
-        return response.status, response.reason, response_text
+        return response.status, response.reason, response_text, response.headers
+
+
+def _get_retry_delay(error: HTTPError, attempt: int, retry_deadline: float) -> Optional[float]:
+    """
+    Returns time to wait before retrying the request: Retry-After sent by Dynatrace if present,
+    otherwise exponential backoff with full jitter, so that throttled batches don't come back at the same time.
+    None if the request shouldn't be retried, or the retry wouldn't fit in the retry time budget.
+    """
+    if error.code not in RETRYABLE_STATUSES:
+        return None
+    retry_delay = _parse_retry_after(error.headers)
+    if retry_delay is None:
+        retry_delay = random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BASE_BACKOFF * 2 ** attempt))
+    if time.perf_counter() + retry_delay > retry_deadline:
+        return None
+    return retry_delay
+
+
+def _parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    retry_after = headers.get("Retry-After") if headers else None
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def prepare_serialized_batches(logs: Iterable[Union[Dict, bytes]]) -> List[LogBatch]:
+    return list(iterate_serialized_batches(logs))
 
 
 # Heavily based on AWS log forwarder batching implementation
-def prepare_serialized_batches(logs: List[Dict]) -> List[LogBatch]:
+def iterate_serialized_batches(logs: Iterable[Union[Dict, bytes]]) -> Iterator[LogBatch]:
     request_body_max_size = get_int_environment_value("DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", 4718592)
     request_max_events = get_int_environment_value("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", 5000)
     log_entry_max_size = request_body_max_size - 2  # account for braces
 
-    batches: List[LogBatch] = []
-
-    logs_for_next_batch: List[str] = []
-    logs_for_next_batch_total_len = 0
-    logs_for_next_batch_events_count = 0
-
-    log_entries = 0
+    batch_builder = BatchBuilder(request_body_max_size, request_max_events, streaming_compression_enabled)
     for log_entry in logs:
-        new_batch_len = logs_for_next_batch_total_len + 2 + len(logs_for_next_batch) - 1  # add bracket length (2) and commas for each entry but last one.
-
-        next_entry_serialized = json.dumps(log_entry)
+        # entries parsed in other processes come already serialized
+        next_entry_serialized = log_entry if isinstance(log_entry, bytes) else json_codec.dumps(log_entry)
 
-        next_entry_size = len(next_entry_serialized.encode("UTF-8"))
+        next_entry_size = len(next_entry_serialized)
         if next_entry_size > log_entry_max_size:
             # shouldn't happen as we are already truncating the content field, but just for safety
             logging.info(f"Dropping entry, as its size is {next_entry_size}, bigger than max entry size: {log_entry_max_size}")
 
-        batch_length_if_added_entry = new_batch_len + 1 + len(next_entry_serialized)  # +1 is for comma
-
-        if batch_length_if_added_entry > request_body_max_size or logs_for_next_batch_events_count >= request_max_events:
+        if batch_builder.number_of_logs and not batch_builder.fits(next_entry_serialized):
             # would overflow limit, close batch and prepare new
-            batch = LogBatch("[" + ",".join(logs_for_next_batch) + "]", log_entries)
-            batches.append(batch)
-            log_entries = 0
+            yield batch_builder.close()
+            batch_builder = BatchBuilder(request_body_max_size, request_max_events, streaming_compression_enabled)
 
-            logs_for_next_batch = []
-            logs_for_next_batch_total_len = 0
-            logs_for_next_batch_events_count = 0
+        batch_builder.add(next_entry_serialized)
 
-        logs_for_next_batch.append(next_entry_serialized)
-        log_entries += 1
-        logs_for_next_batch_total_len += next_entry_size
-        logs_for_next_batch_events_count += 1
-
-    if len(logs_for_next_batch) >= 1:
+    if batch_builder.number_of_logs >= 1:
         # finalize the last batch
-        batch = LogBatch("[" + ",".join(logs_for_next_batch) + "]", log_entries)
-        batches.append(batch)
-
-    return batches
\ No newline at end of file
+        yield batch_builder.close()
@@ -14,15 +14,28 @@
 import fnmatch
 import os
 import re
-from typing import Dict, Set
+from typing import Dict, Set, List, Optional, Pattern, FrozenSet, NamedTuple
 
 from logs_ingest import logging
 from logs_ingest.mapping import severity_to_log_level_dict, log_level_to_severity_dict, RESOURCE_TYPE_ATTRIBUTE, \
     RESOURCE_ID_ATTRIBUTE
+from logs_ingest.util.lru_cache import LruCache, MISSING
 
 GLOBAL = "global"
 FILTER_NAMES_PREFIXES = ["filter.resource_type.min_log_level.", "filter.resource_type.contains_pattern.",
                          "filter.resource_id.min_log_level.","filter.resource_id.contains_pattern."]
+SCOPE_FILTERS_CACHE_MAX_SIZE = 4096
+
+
+class ScopeFilter(NamedTuple):
+    """Filters of a scope (global, resource type or resource id) compiled into a single check"""
+    severities: Optional[FrozenSet[str]]  # None if severity isn't filtered
+    content_pattern: Optional[Pattern]  # None if content isn't filtered
+
+    def should_filter_out(self, severity: str, content) -> bool:
+        if self.severities is not None and severity not in self.severities:
+            return True
+        return self.content_pattern is not None and not self.content_pattern.match(str(content))
 
 
 class LogFilter:
@@ -34,6 +47,7 @@ class LogFilter:
         self._filters_tuples = [modified_filter_tuple for filter_tuple in self._filters_tuples
                                 if (modified_filter_tuple := self._prepare_filters_tuples(filter_tuple)) is not None]
         self.filters_dict = self._prepare_filters_dict()
+        self._scope_filters_cache = LruCache(SCOPE_FILTERS_CACHE_MAX_SIZE)
 
     @staticmethod
     def _prepare_filters_tuples(filter_tuple):
@@ -51,35 +65,26 @@ class LogFilter:
 
         return None
 
-    def _prepare_filters_dict(self) -> Dict:
+    def _prepare_filters_dict(self) -> Dict[str, ScopeFilter]:
         grouped_filters = self._group_filters()
         filters_to_apply_dict = {}
         parsed_filters_to_log = []
         for k, filter_name_value_dict in grouped_filters.items():
-            filters_to_apply = []
+            severities = None
+            patterns = []
             for filter_name, filter_value in filter_name_value_dict.items():
                 if "min_log_level" in filter_name:
                     log_levels = self._get_log_levels(filter_value)
                     if log_levels:
-                        log_level_filter = self._create_log_level_filter(log_levels)
-                        filters_to_apply.append(log_level_filter)
+                        # several log level filters of a scope must all pass
+                        severities = frozenset(log_levels) if severities is None else severities & log_levels
                         parsed_filters_to_log.append(filter_name)
                 if "contains_pattern" in filter_name:
-                    if isinstance(filter_value, list):
-                        for filter_pattern in filter_value:
-                            contains_pattern_filter = (
-                                self._create_contains_pattern_filter(filter_pattern)
-                            )
-                            filters_to_apply.append(contains_pattern_filter)
-                            parsed_filters_to_log.append(filter_name)
-                    if not isinstance(filter_value, list):
-                        contains_pattern_filter = self._create_contains_pattern_filter(
-                            filter_value
-                        )
-                        filters_to_apply.append(contains_pattern_filter)
-                        parsed_filters_to_log.append(filter_name)
-            if filters_to_apply:
-                filters_to_apply_dict[k] = filters_to_apply
+                    filter_patterns = filter_value if isinstance(filter_value, list) else [filter_value]
+                    patterns.extend(filter_patterns)
+                    parsed_filters_to_log.extend(filter_name for _ in filter_patterns)
+            if severities is not None or patterns:
+                filters_to_apply_dict[k] = ScopeFilter(severities, self._compile_contains_patterns(patterns))
         logging.info(f"Successfully parsed filters: {parsed_filters_to_log}")
         return filters_to_apply_dict
 
@@ -104,48 +109,28 @@ class LogFilter:
         return filters_dict
 
     @staticmethod
-    def _create_log_level_filter(log_levels: Set):
-        return lambda severity, record: severity in log_levels
-
-    @staticmethod
-    def _create_contains_pattern_filter(pattern: str):
-        return lambda severity, record: fnmatch.fnmatch(record, pattern)
+    def _compile_contains_patterns(patterns: List[str]) -> Optional[Pattern]:
+        # Content has to match any of the patterns - they are combined into a single regex
+        if not patterns:
+            return None
+        return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
 
     def should_filter_out_record(self, parsed_record: Dict) -> bool:
         if not self.filters_dict:
             return False
 
-        severity = parsed_record.get("severity", "")
-        resource_id = parsed_record.get(RESOURCE_ID_ATTRIBUTE, "").casefold()
-        resource_type = parsed_record.get(RESOURCE_TYPE_ATTRIBUTE, "").casefold()
-        content = parsed_record.get("content", "")
-
-        log_filters = self._get_filters(resource_id, resource_type)
-
-        filter_patterns = []
-
-        for log_filter in log_filters:
-            if 'contains_pattern' in str(log_filter):
-                filter_patterns.append(log_filter)
-
-        pipe_separated_filters_result = True
-
-        if len(filter_patterns) > 1:
-            log_filters = set(log_filters) - set(filter_patterns)
-            pipe_separated_filters_result = any(log_filter(severity, str(content)) for log_filter in filter_patterns)
-
-        return (not all(log_filter(severity, str(content)) for log_filter in log_filters)
-                or not pipe_separated_filters_result)
-
-
-
-    def _get_filters(self, resource_id, resource_type):
-        filters = self.filters_dict.get(resource_id, [])
-        if not filters:
-            filters = self.filters_dict.get(resource_type, [])
-        if not filters:
-            filters = self.filters_dict.get(GLOBAL, [])
-        return filters
+        scope_filter = self._get_filter(parsed_record.get(RESOURCE_ID_ATTRIBUTE, ""), parsed_record.get(RESOURCE_TYPE_ATTRIBUTE, ""))
+        return scope_filter is not None and scope_filter.should_filter_out(parsed_record.get("severity", ""), parsed_record.get("content", ""))
+
+    def _get_filter(self, resource_id: str, resource_type: str) -> Optional[ScopeFilter]:
+        # Filters of resource take precedence over filters of resource type, and those over global filters
+        scope_key = (resource_id, resource_type)
+        scope_filter = self._scope_filters_cache.get(scope_key)
+        if scope_filter is MISSING:
+            scope_filter = self.filters_dict.get(resource_id.casefold()) or self.filters_dict.get(resource_type.casefold()) \
+                           or self.filters_dict.get(GLOBAL)
+            self._scope_filters_cache.put(scope_key, scope_filter)
+        return scope_filter
 
     @staticmethod
     def _get_log_levels(min_log_level) -> Set:
@@ -0,0 +1,126 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import re
+from json.scanner import make_scanner
+from typing import Any, Union, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    # installed from requirements.txt - much faster decoding of large Event Hub bodies, stdlib json is the fallback
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_scan_once = make_scanner(json.JSONDecoder())
+
+
+def loads(text: Union[str, bytes, bytearray]) -> Any:
+    """
+    Decodes valid JSON with the fastest available backend.
+    orjson is stricter than stdlib json (NaN, Infinity, integers above 64 bits), so whatever it rejects is decoded with stdlib json,
+    which stays the reference - both raise json.JSONDecodeError on invalid input.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encodes JSON to UTF-8 bytes with the fastest available backend.
+    orjson output is compact and keeps non-ASCII characters unescaped, but decodes to the same value as stdlib json output.
+    Objects orjson can't encode (integers above 64 bits, non-string keys) are encoded with stdlib json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj).encode("UTF-8")
+
+
+def loads_with_raw_items(text: str, key: str) -> Tuple[Dict, Optional[List[str]]]:
+    """
+    Decodes JSON object like json.loads, additionally returning raw text of every item of the array under the given key,
+    so that items which don't change can be reused without encoding them again.
+    Values are decoded with the stdlib scanner. Raises ValueError if the text isn't a valid JSON object.
+    """
+    obj = {}
+    raw_items = None
+    index = _skip_whitespace(text, 0)
+    _expect(text, index, "{")
+    index = _skip_whitespace(text, index + 1)
+    closed = text.startswith("}", index)
+    while not closed:
+        _expect(text, index, '"')
+        name, index = _scan(text, index)
+        index = _skip_whitespace(text, index)
+        _expect(text, index, ":")
+        index = _skip_whitespace(text, index + 1)
+        if name == key and text.startswith("[", index):
+            value, raw_items, index = _scan_array_with_raw_items(text, index)
+        else:
+            value, index = _scan(text, index)
+            raw_items = None if name == key else raw_items
+        obj[name] = value
+        index = _skip_whitespace(text, index)
+        closed = not text.startswith(",", index)
+        if closed:
+            _expect(text, index, "}")
+        else:
+            index = _skip_whitespace(text, index + 1)
+
+    if _skip_whitespace(text, index + 1) != len(text):
+        raise json.JSONDecodeError("Extra data", text, index + 1)
+    return obj, raw_items
+
+
+def _scan_array_with_raw_items(text: str, index: int) -> Tuple[List, List[str], int]:
+    items, raw_items = [], []
+    index = _skip_whitespace(text, index + 1)
+    if text.startswith("]", index):
+        return items, raw_items, index + 1
+    while True:
+        item, end = _scan(text, index)
+        items.append(item)
+        raw_items.append(text[index:end])
+        index = _skip_whitespace(text, end)
+        if not text.startswith(",", index):
+            _expect(text, index, "]")
+            return items, raw_items, index + 1
+        index = _skip_whitespace(text, index + 1)
+
+
+def _scan(text: str, index: int) -> Tuple[Any, int]:
+    try:
+        return _scan_once(text, index)
+    except StopIteration as e:
+        raise json.JSONDecodeError("Expecting value", text, e.value) from None
+
+
+def _skip_whitespace(text: str, index: int) -> int:
+    return WHITESPACE.match(text, index).end()
+
+
+def _expect(text: str, index: int, character: str):
+    if not text.startswith(character, index):
+        raise json.JSONDecodeError(f"Expecting '{character}'", text, index)
@@ -13,39 +13,63 @@
 #   limitations under the License.
 
 import json
+import multiprocessing
 import os
+import re
+import threading
 import time
-from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone, timedelta
+from itertools import chain
 from json import JSONDecodeError
-from typing import List, Dict, Optional
-import re
-import asyncio
+from math import ceil
+from types import SimpleNamespace
+from typing import List, Dict, Optional, Iterator, Callable, Tuple, Union
 
 import azure.functions as func
-from dateutil import parser
 
-from . import logging
-from .dynatrace_client import send_logs
+from . import json_codec, logging
+from .dynatrace_client import send_logs, run_in_sender_loop
 from .filtering import LogFilter
 from .mapping import extract_resource_id_attributes, extract_severity, azure_properties_names
 from .metadata_engine import MetadataEngine
 from .monitored_entity_id import infer_monitored_entity_id
 from .self_monitoring import SelfMonitoring
 from .util import util_misc
+from .util.timestamps import normalize_timestamp
 from .util.util_misc import get_int_environment_value
 
 record_age_limit = get_int_environment_value("DYNATRACE_LOG_INGEST_MAX_RECORD_AGE", 3600 * 24)
 attribute_value_length_limit = get_int_environment_value("DYNATRACE_LOG_INGEST_ATTRIBUTE_VALUE_MAX_LENGTH", 250)
 content_length_limit = get_int_environment_value("DYNATRACE_LOG_INGEST_CONTENT_MAX_LENGTH", 8192)
 cloud_log_forwarder = os.environ.get("RESOURCE_ID", "")  # Function app id
+raw_content_passthrough_enabled = os.environ.get("RAW_CONTENT_PASSTHROUGH_ENABLED", "False") in ["True", "true"]
+number_of_parsing_processes = get_int_environment_value("NUMBER_OF_PARSING_PROCESSES", 0)
+parallel_parsing_min_events = get_int_environment_value("PARALLEL_PARSING_MIN_EVENTS", 64)
+PARSING_CHUNKS_PER_PROCESS = 4
 
 DYNATRACE_URL = "DYNATRACE_URL"
 DYNATRACE_ACCESS_KEY = "DYNATRACE_ACCESS_KEY"
 DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED = "[TRUNCATED]"
 
+ESCAPED_OR_SINGLE_QUOTE = re.compile(r"\\'|'")
+
+# Replacements fixing malformed JSON sent by some Azure services, tried in order when the text isn't valid JSON.
+# Each one is a single pass over the text: (name reported in self monitoring, repair, strict decoding)
+JSON_REPAIR_TIERS: List[Tuple[str, Callable[[str], str], bool]] = [
+    ("newlines_removed", lambda text: text.replace("\n", ""), False),
+    ("single_quotes_replaced", lambda text: text.replace("\'", "\""), True),
+    ("escaped_single_quotes_removed", lambda text: ESCAPED_OR_SINGLE_QUOTE.sub(lambda match: "" if len(match.group()) == 2 else "\"", text), False),
+]
+
 metadata_engine = MetadataEngine()
 log_filter = LogFilter()
 
+# Pool of parsing processes shared by executions, replaced when one of its processes dies
+_parsing_processes = SimpleNamespace(executor=None)
+_parsing_processes_lock = threading.Lock()
+
 
 def main(events: List[func.EventHubEvent]):
     self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
@@ -57,15 +81,14 @@ def process_logs(events: List[func.EventHubEvent], self_monitoring: SelfMonitori
         verify_dt_access_params_provided()
         logging.throttling_counter.reset_throttling_counter()
 
-        start_time = time.perf_counter()
-
-        logs_to_be_sent_to_dt = extract_logs(events, self_monitoring)
+        # Logs are parsed lazily, so only batches being sent are kept in memory. Parsing runs on the event loop (unless PARSING_THREAD_ENABLED),
+        # requests in flight make progress only when a batch is complete
+        logs_to_be_sent_to_dt = measure_processing_time(extract_logs(events, self_monitoring), self_monitoring)
 
-        self_monitoring.processing_time = time.perf_counter() - start_time
-        logging.info(f"Successfully parsed {len(logs_to_be_sent_to_dt)} log records")
-
-        if logs_to_be_sent_to_dt:
-            asyncio.run(send_logs(os.environ[DYNATRACE_URL], os.environ[DYNATRACE_ACCESS_KEY], logs_to_be_sent_to_dt, self_monitoring))
+        first_log = next(logs_to_be_sent_to_dt, None)
+        if first_log is not None:
+            logs_to_be_sent_to_dt = chain((first_log,), logs_to_be_sent_to_dt)
+            run_in_sender_loop(send_logs(os.environ[DYNATRACE_URL], os.environ[DYNATRACE_ACCESS_KEY], logs_to_be_sent_to_dt, self_monitoring))
     except Exception as e:
         logging.exception("Failed to process logs", "log-processing-exception")
         raise e
@@ -81,58 +104,174 @@ def verify_dt_access_params_provided():
         raise KeyError(f"Please set {DYNATRACE_URL} and {DYNATRACE_ACCESS_KEY} in application settings")
 
 
-def extract_logs(events: List[func.EventHubEvent], self_monitoring: SelfMonitoring):
-    logs_to_be_sent_to_dt = []
+def measure_processing_time(logs: Iterator[Union[Dict, bytes]], self_monitoring: SelfMonitoring) -> Iterator[Union[Dict, bytes]]:
+    number_of_logs = 0
+    while True:
+        start_time = time.perf_counter()
+        log = next(logs, None)
+        self_monitoring.processing_time += time.perf_counter() - start_time
+        if log is None:
+            logging.info(f"Successfully parsed {number_of_logs} log records")
+            return
+        number_of_logs += 1
+        yield log
+
+
+def extract_logs(events: List[func.EventHubEvent], self_monitoring: SelfMonitoring) -> Iterator[Union[Dict, bytes]]:
+    # Logs Ingest API won't accept any log line older than one day, 60 seconds of margin to send
+    oldest_accepted_time = datetime.now(timezone.utc) - timedelta(seconds=record_age_limit - 60)
+    if number_of_parsing_processes > 1 and len(events) >= parallel_parsing_min_events:
+        yield from extract_logs_in_processes(events, oldest_accepted_time, self_monitoring)
+        return
+
     for event in events:
-        timestamp = event.enqueued_time.replace(microsecond=0).replace(tzinfo=None).isoformat() + 'Z' if event.enqueued_time else None
-        if is_too_old(timestamp, self_monitoring, "event"):
-            continue
+        yield from extract_event_logs(event.get_body(), event.enqueued_time, oldest_accepted_time, self_monitoring)
+
+
+def extract_logs_in_processes(events: List[func.EventHubEvent], oldest_accepted_time: datetime,
+                              self_monitoring: SelfMonitoring) -> Iterator[Union[Dict, bytes]]:
+    """
+    Parses events in parsing processes, several chunks per process so that they are evenly loaded.
+    Logs of each chunk are yielded (in order of events) as soon as the chunk is parsed.
+    If a parsing process dies, the pool is discarded and chunks left by it are parsed in the function process.
+    """
+    chunk_size = ceil(len(events) / (number_of_parsing_processes * PARSING_CHUNKS_PER_PROCESS))
+    chunks = [[(event.get_body(), event.enqueued_time) for event in events[start:start + chunk_size]]
+              for start in range(0, len(events), chunk_size)]
+    parsing_executor = get_parsing_executor()
+    futures = []
+    try:
+        for chunk in chunks:
+            futures.append(parsing_executor.submit(extract_serialized_logs, chunk, oldest_accepted_time, self_monitoring.execution_time))
+    except BrokenProcessPool:
+        # a process died after previous execution, chunks without future are parsed in function process
+        pass
 
-        event_body = event.get_body().decode('utf-8')
-        event_json = parse_to_json(event_body)
-        if event_json:
-            records = event_json.get("records", [])
-            for record in records:
+    try:
+        pool_broken = False
+        for index, chunk in enumerate(chunks):
+            if not pool_broken:
                 try:
-                    extracted_record = extract_dt_record(record, self_monitoring)
-                    if extracted_record:
-                        logs_to_be_sent_to_dt.append(extracted_record)
-                except JSONDecodeError as json_e:
-                    self_monitoring.parsing_errors += 1
-                    logging.exception(
-                        f"Failed to decode JSON for the record (base64 applied for safety!): {util_misc.to_base64_text(str(record))}. Exception: {json_e}",
-                        "log-record-parsing-jsondecode-exception")
-                except Exception as e:
-                    self_monitoring.parsing_errors += 1
-                    logging.exception(
-                        f"Failed to parse log record (base64 applied for safety!): {util_misc.to_base64_text(str(record))}. Exception: {e}",
-                        "log-record-parsing-exception")
-    return logs_to_be_sent_to_dt
-
-
-def extract_dt_record(record: Dict, self_monitoring: SelfMonitoring) -> Optional[Dict]:
-    deserialize_properties(record)
-
-    parsed_record = parse_record(record, self_monitoring)
+                    if index >= len(futures):
+                        raise BrokenProcessPool("Parsing processes terminated before all chunks were submitted")
+                    serialized_logs, chunk_self_monitoring = futures[index].result()
+                except BrokenProcessPool:
+                    # broken pool fails all its futures, the rest of the chunks isn't waited for
+                    logging.exception("Parsing process terminated abruptly, parsing events in function process", "parsing-process-exception")
+                    pool_broken = True
+                    discard_parsing_executor(parsing_executor)
+                else:
+                    self_monitoring.merge(chunk_self_monitoring)
+                    yield from serialized_logs
+                    continue
+            for body, enqueued_time in chunk:
+                yield from extract_event_logs(body, enqueued_time, oldest_accepted_time, self_monitoring)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def get_parsing_executor() -> ProcessPoolExecutor:
+    # Processes are started once and reused by following executions. Spawned (not forked from the multithreaded worker),
+    # each imports this module only once - building its MetadataEngine and LogFilter
+    with _parsing_processes_lock:
+        if _parsing_processes.executor is None:
+            _parsing_processes.executor = ProcessPoolExecutor(max_workers=number_of_parsing_processes,
+                                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parsing_processes.executor
+
+
+def discard_parsing_executor(parsing_executor: ProcessPoolExecutor):
+    # next execution starts new processes, unless another thread has replaced the pool already
+    with _parsing_processes_lock:
+        if _parsing_processes.executor is parsing_executor:
+            _parsing_processes.executor = None
+    parsing_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_serialized_logs(events: List[Tuple[bytes, Optional[datetime]]], oldest_accepted_time: datetime,
+                            execution_time: datetime) -> Tuple[List[bytes], SelfMonitoring]:
+    """Runs in parsing process. Logs are returned serialized, as bytes are much cheaper to pass between processes than dicts"""
+    logging.throttling_counter.reset_throttling_counter()
+    self_monitoring = SelfMonitoring(execution_time=execution_time)
+    serialized_logs = []
+    for body, enqueued_time in events:
+        serialized_logs.extend(json_codec.dumps(log) for log in extract_event_logs(body, enqueued_time, oldest_accepted_time, self_monitoring))
+    return serialized_logs, self_monitoring
+
+
+def extract_event_logs(body: bytes, enqueued_time: Optional[datetime], oldest_accepted_time: datetime,
+                       self_monitoring: SelfMonitoring) -> Iterator[Dict]:
+    if is_event_too_old(enqueued_time, oldest_accepted_time, self_monitoring):
+        return
+
+    event_json, raw_records = parse_event_body(body, self_monitoring)
+    if event_json:
+        records = event_json.get("records", [])
+        for index, record in enumerate(records):
+            try:
+                raw_record = raw_records[index] if raw_records else None
+                extracted_record = extract_dt_record(record, oldest_accepted_time, self_monitoring, raw_record)
+                if extracted_record:
+                    yield extracted_record
+            except JSONDecodeError as json_e:
+                self_monitoring.parsing_errors += 1
+                logging.exception(
+                    f"Failed to decode JSON for the record (base64 applied for safety!): {util_misc.to_base64_text(str(record))}. Exception: {json_e}",
+                    "log-record-parsing-jsondecode-exception")
+            except Exception as e:
+                self_monitoring.parsing_errors += 1
+                logging.exception(
+                    f"Failed to parse log record (base64 applied for safety!): {util_misc.to_base64_text(str(record))}. Exception: {e}",
+                    "log-record-parsing-exception")
+
+
+def parse_event_body(body: bytes, self_monitoring: SelfMonitoring) -> Tuple[Optional[Dict], Optional[List[str]]]:
+    if raw_content_passthrough_enabled:
+        try:
+            return json_codec.loads_with_raw_items(body.decode("utf-8"), "records")
+        except Exception:
+            pass  # malformed body is repaired as usual, records will be encoded again
+    # body is decoded straight from bytes, without copying it to str first
+    return parse_to_json(body, self_monitoring), None
+
+
+def extract_dt_record(record: Dict, oldest_accepted_time: datetime, self_monitoring: SelfMonitoring,
+                      raw_record: Optional[str] = None) -> Optional[Dict]:
+    if deserialize_properties(record, self_monitoring):
+        # raw record text contains properties as string
+        raw_record = None
+
+    parsed_record = parse_record(record, self_monitoring, raw_record)
     if not parsed_record:
         return None
 
-    timestamp = parsed_record.get("timestamp", None)
-    if is_too_old(timestamp, self_monitoring, "record"):
+    if is_too_old(parsed_record, oldest_accepted_time, self_monitoring):
         return None
 
     return parsed_record
 
 
-def is_too_old(timestamp: str, self_monitoring: SelfMonitoring, log_part: str):
+def is_event_too_old(enqueued_time: Optional[datetime], oldest_accepted_time: datetime, self_monitoring: SelfMonitoring):
+    if enqueued_time:
+        # Event Hub enqueued time is in UTC, compared with seconds precision
+        enqueued_time = enqueued_time.replace(microsecond=0, tzinfo=timezone.utc)
+        if enqueued_time < oldest_accepted_time:
+            logging.info(f"Skipping too old event with timestamp '{enqueued_time.replace(tzinfo=None).isoformat()}Z'")
+            self_monitoring.too_old_records += 1
+            return True
+    return False
+
+
+def is_too_old(parsed_record: Dict, oldest_accepted_time: datetime, self_monitoring: SelfMonitoring):
+    """Checks age of the record, replacing its timestamp with the normalized one on the way, so it's parsed only once"""
+    timestamp = parsed_record.get("timestamp", None)
     if timestamp:
         try:
-            date = parser.parse(timestamp)
-            if not date.tzinfo:
-                date=date.replace(tzinfo=timezone.utc)
-            # Logs Ingest API won't accept any log line older than one day, 60 seconds of margin to send
-            if (datetime.now(timezone.utc) - date).total_seconds() > (record_age_limit - 60):
-                logging.info(f"Skipping too old {log_part} with timestamp '{timestamp}'")
+            normalized_timestamp = normalize_timestamp(timestamp)
+            parsed_record["timestamp"] = normalized_timestamp.text
+            if normalized_timestamp.epoch < oldest_accepted_time.timestamp():
+                logging.info(f"Skipping too old record with timestamp '{timestamp}'")
                 self_monitoring.too_old_records += 1
                 return True
         except Exception:
@@ -142,14 +281,16 @@ def is_too_old(timestamp: str, self_monitoring: SelfMonitoring, log_part: str):
     return False
 
 
-def deserialize_properties(record: Dict):
+def deserialize_properties(record: Dict, self_monitoring: Optional[SelfMonitoring] = None) -> bool:
     properties_name = next((properties for properties in azure_properties_names if properties in record.keys()), "")
     properties = record.get(properties_name, {})
     if properties and isinstance(properties, str):
-        record["properties"] = parse_to_json(properties)
+        record["properties"] = parse_to_json(properties, self_monitoring)
+        return True
+    return False
 
 
-def parse_record(record: Dict, self_monitoring: SelfMonitoring):
+def parse_record(record: Dict, self_monitoring: SelfMonitoring, raw_record: Optional[str] = None):
     parsed_record = {
         "cloud.provider": "Azure"
     }
@@ -159,10 +300,9 @@ def parse_record(record: Dict, self_monitoring: SelfMonitoring):
     if "resourceId" in record:
         extract_resource_id_attributes(parsed_record, record["resourceId"])
 
-    metadata_engine.apply(record, parsed_record)
-    convert_date_format(parsed_record)
+    metadata_engine.apply(record, parsed_record, self_monitoring)
     category = record.get("category", "").lower()
-    infer_monitored_entity_id(category, parsed_record)
+    infer_monitored_entity_id(category, parsed_record, self_monitoring)
 
     for attribute_key, attribute_value in parsed_record.items():
         if attribute_key not in ["content", "severity", "timestamp"] and attribute_value:
@@ -177,42 +317,61 @@ def parse_record(record: Dict, self_monitoring: SelfMonitoring):
         return None
 
     if content:
-        if not isinstance(content, str):
+        if content is record and raw_record is not None:
+            # content is the whole record, its text from the event body is used instead of encoding the record again
+            parsed_record["content"] = raw_record
+        elif not isinstance(content, str):
+            # stdlib format on purpose - content is what users see and search in Dynatrace
             parsed_record["content"] = json.dumps(parsed_record["content"])
-        if len(parsed_record["content"]) > content_length_limit:
-            self_monitoring.too_long_content_size.append(len(parsed_record["content"]))
-            trimmed_len = content_length_limit - len(DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED)
-            parsed_record["content"] = parsed_record["content"][
-                                       :trimmed_len] + DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED
+        parsed_record["content"] = trim_content(parsed_record["content"], self_monitoring)
     return parsed_record
 
 
+def trim_content(content: str, self_monitoring: SelfMonitoring) -> str:
+    """Trims content to content_length_limit bytes of UTF-8, without splitting the last character"""
+    if content.isascii():
+        if len(content) <= content_length_limit:
+            return content
+        self_monitoring.too_long_content_size.append(len(content))
+        return content[:content_length_limit - len(DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED)] + DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED
+
+    encoded_content = content.encode("UTF-8", "surrogatepass")
+    if len(encoded_content) <= content_length_limit:
+        return content
+    self_monitoring.too_long_content_size.append(len(encoded_content))
+    trimmed_size = content_length_limit - len(DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED)
+    # step back from continuation bytes (10xxxxxx) to the first byte of the character
+    while trimmed_size > 0 and encoded_content[trimmed_size] & 0xC0 == 0x80:
+        trimmed_size -= 1
+    return encoded_content[:trimmed_size].decode("UTF-8", "surrogatepass") + DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED
+
+
 def extract_cloud_log_forwarder(parsed_record):
     if cloud_log_forwarder:
         parsed_record["cloud.log_forwarder"] = cloud_log_forwarder
 
 
-def parse_to_json(text):
+def parse_to_json(text: Union[str, bytes], self_monitoring: Optional[SelfMonitoring] = None):
     try:
-        event_json = json.loads(text)
-    except Exception:
+        return json_codec.loads(text)
+    except Exception as e:
+        last_exception = e
+
+    # repairs work on text, so bytes are decoded only when they aren't valid JSON
+    if isinstance(text, (bytes, bytearray)):
+        text = text.decode("utf-8")
+
+    for repair_tier, repair, strict in JSON_REPAIR_TIERS:
         try:
-            event_json = json.loads(text.replace("\n", ""), strict=False)
-        except Exception:
-            try:
-                event_json = json.loads(text.replace("\'", "\""))
-            except Exception:
-                try:
-                    event_json = json.loads(text.replace('\\\'', '').replace("\'", "\""), strict=False)
-                except Exception:
-                    logging.exception(
-                        f"Failed to decode JSON for the event (base64 applied for safety!): {util_misc.to_base64_text(str(text))}.",
-                        "log-record-parsing-jsondecode-exception")
-                    return None
-    return event_json
-
-
-def convert_date_format(record):
-    timestamp = record.get("timestamp", None)
-    if timestamp and re.findall('[0-9]{2}/[0-9]{2}/[0-9]{4} [0-9]{2}:[0-9]{2}:[0-9]{2}', timestamp):
-        record["timestamp"] = str(datetime.strptime(timestamp, '%m/%d/%Y %H:%M:%S').isoformat()) + "Z"
+            event_json = json.loads(repair(text), strict=strict)
+        except Exception as e:
+            last_exception = e
+            continue
+        if self_monitoring:
+            self_monitoring.json_repairs[repair_tier] += 1
+        return event_json
+
+    logging.exception(
+        f"Failed to decode JSON for the event (base64 applied for safety!): {util_misc.to_base64_text(str(text))}.",
+        "log-record-parsing-jsondecode-exception", exc_info=last_exception)
+    return None
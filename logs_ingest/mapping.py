@@ -14,9 +14,11 @@
 
 import json
 import os
-from typing import Dict
+import sys
+from typing import Dict, NamedTuple, Tuple
 
 from . import logging
+from .util.lru_cache import LruCache, MISSING
 
 DEFAULT_SEVERITY_INFO = "Informational"
 
@@ -26,6 +28,8 @@ RESOURCE_GROUP_ATTRIBUTE = "azure.resource.group"
 RESOURCE_TYPE_ATTRIBUTE = "azure.resource.type"
 RESOURCE_NAME_ATTRIBUTE = "azure.resource.name"
 
+RESOURCE_ID_CACHE_MAX_SIZE = 4096
+
 log_level_to_severity_dict = {
     1: 'Critical',
     2: 'Error',
@@ -55,7 +59,33 @@ except Exception:
                       "meType-mapping-file-loading-exception")
 
 
+class ParsedResourceId(NamedTuple):
+    resource_id: str
+    segments: Tuple[str, ...]  # resource_id split by "/"
+    attributes: Tuple[Tuple[str, str], ...]  # subscription, resource group, name and type - empty for invalid resource id
+
+
+# Logs of a batch come from a limited number of resources - each resource id is parsed once and its records share the attribute values.
+# Only subscription, resource group and type are interned: interned strings may never be freed, so ids and names are left to the cache
+_parsed_resource_ids = LruCache(RESOURCE_ID_CACHE_MAX_SIZE)
+
+
 def extract_resource_id_attributes(parsed_record: Dict, resource_id: str):
+    parsed_resource_id = parse_resource_id(resource_id)
+    parsed_record[RESOURCE_ID_ATTRIBUTE] = parsed_resource_id.resource_id
+    parsed_record.update(parsed_resource_id.attributes)
+
+
+def parse_resource_id(resource_id: str) -> ParsedResourceId:
+    parsed_resource_id = _parsed_resource_ids.get(resource_id)
+    if parsed_resource_id is MISSING:
+        segments = tuple(resource_id.split("/"))
+        parsed_resource_id = ParsedResourceId(resource_id, segments, _create_resource_id_attributes(segments))
+        _parsed_resource_ids.put(resource_id, parsed_resource_id)
+    return parsed_resource_id
+
+
+def _create_resource_id_attributes(segments: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
     """
     based on https://github.com/Azure/azure-libraries-for-net/blob/Fluent-v1.37.0/src/ResourceManagement/ResourceManager/Core/ResourceId.cs#L29
     Format of id:
@@ -63,28 +93,27 @@ def extract_resource_id_attributes(parsed_record: Dict, resource_id: str):
     0             1                2              3                   4         5                                                        N-2            N-1
     example: /SUBSCRIPTIONS/69B51384-146C-4685-9DAB-5AE01877D7B8/RESOURCEGROUPS/TESTMS/PROVIDERS/MICROSOFT.APIMANAGEMENT/SERVICE/WEATHERAPP-API-MGMT
     """
-    parsed_record[RESOURCE_ID_ATTRIBUTE] = resource_id
-    parts = resource_id.lstrip("/").split("/")
+    # leading slashes are skipped
+    parts = segments[next((index for index, segment in enumerate(segments) if segment), len(segments)):]
 
     # No logging on invalid resource_id to avoid flooding logs. Invalid resource id will be sent
     # with log line to Dynatrace so we keep the ability to debug in case of any issues
     if len(parts) < 7:
-        return
+        return ()
     if parts[0].casefold() != "SUBSCRIPTIONS".casefold():
-        return
+        return ()
     if parts[2].casefold() != "RESOURCEGROUPS".casefold():
-        return
+        return ()
     if parts[4].casefold() != "PROVIDERS".casefold():
-        return
-
-    parsed_record[SUBSCRIPTION_ATTRIBUTE] = parts[1]
-    parsed_record[RESOURCE_GROUP_ATTRIBUTE] = parts[3]
-    parsed_record[RESOURCE_NAME_ATTRIBUTE] = parts[-1]
+        return ()
 
     resource_type_parts_with_parent = parts[5:-1]
     # Filter out parent resource name to create hierarchic resource type as cloudbuilder does
     resource_type_parts = [part for index, part in enumerate(resource_type_parts_with_parent) if (index == 0 or index % 2 != 0)]
-    parsed_record[RESOURCE_TYPE_ATTRIBUTE] = "/".join(resource_type_parts)
+    return ((SUBSCRIPTION_ATTRIBUTE, sys.intern(parts[1])),
+            (RESOURCE_GROUP_ATTRIBUTE, sys.intern(parts[3])),
+            (RESOURCE_NAME_ATTRIBUTE, parts[-1]),
+            (RESOURCE_TYPE_ATTRIBUTE, sys.intern("/".join(resource_type_parts))))
 
 
 def extract_severity(record: Dict, parsed_record: Dict):
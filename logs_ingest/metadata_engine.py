@@ -15,21 +15,30 @@
 import json
 import os
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from os import listdir
 from os.path import isfile
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
 import jmespath
+from jmespath.parser import ParsedResult
 
 from . import logging
 from logs_ingest.jmespath import JMESPATH_OPTIONS
 from .mapping import RESOURCE_TYPE_ATTRIBUTE
+from .self_monitoring import SelfMonitoring
+from .util.lru_cache import LruCache, MISSING
+
+RULE_CACHE_MAX_SIZE = 1024
+
+EQ_CONDITION = "$eq".casefold()
+IN_CONDITION = "$in".casefold()
+PREFIX_CONDITION = "$prefix".casefold()
 
 _CONDITION_COMPARATOR_MAP = {
-    "$eq".casefold(): lambda x, y: str(x).casefold() == str(y).casefold(),
-    "$in".casefold(): lambda x, y: str(x).casefold() in str(y).casefold().split(','),
-    "$prefix".casefold(): lambda x, y: str(x).casefold().startswith(str(y).casefold()),
+    EQ_CONDITION: lambda x, y: str(x).casefold() == str(y).casefold(),
+    IN_CONDITION: lambda x, y: str(x).casefold() in str(y).casefold().split(','),
+    PREFIX_CONDITION: lambda x, y: str(x).casefold().startswith(str(y).casefold()),
     "$contains".casefold(): lambda x, y: str(y).casefold() in str(x).casefold(),
 }
 
@@ -43,12 +52,20 @@ _SOURCE_VALUE_EXTRACTOR_MAP = {
 class Attribute:
     key: str
     pattern: str
+    # Compiled once on config load, None if compilation failed - pattern is then evaluated with jmespath.search
+    expression: Optional[ParsedResult] = field(default=None, compare=False, repr=False)
+
+    def search(self, record: Dict) -> Any:
+        if self.expression is not None:
+            return self.expression.search(record, JMESPATH_OPTIONS)
+        return jmespath.search(self.pattern, record, JMESPATH_OPTIONS)
 
 
 class SourceMatcher:
     source: str
     condition: str
     valid = True
+    comparator: Optional[str] = None
 
     _evaluator = None
     _operand = None
@@ -59,6 +76,7 @@ class SourceMatcher:
         self.condition = condition
         for key, condition_comparator in _CONDITION_COMPARATOR_MAP.items():
             if condition.startswith(key):
+                self.comparator = key
                 self._evaluator = condition_comparator
                 break
         operands = re.findall(r"'(.*?)'", condition, re.DOTALL)
@@ -81,6 +99,14 @@ class SourceMatcher:
     def _extract_value(self, record: Dict, parsed_record: Dict) -> Any:
         return self._source_value_extractor(record, parsed_record)
 
+    def indexed_values(self) -> List[str]:
+        # Casefolded source values accepted by $eq or $in matcher - the same way as the evaluator sees them
+        operand = str(self._operand).casefold()
+        return operand.split(',') if self.comparator == IN_CONDITION else [operand]
+
+    def indexed_prefix(self) -> str:
+        return str(self._operand).casefold()
+
 
 @dataclass(frozen=True)
 class ConfigRule:
@@ -89,13 +115,73 @@ class ConfigRule:
     attributes: List[Attribute]
 
 
+_TRIE_RULES_KEY = None
+
+
+class RuleIndex:
+    """
+    Narrows down the rules which may apply to the record, so that only those get evaluated.
+    Every rule is indexed by one of its matchers: $eq/$in in a dictionary of values, $prefix in a trie of characters,
+    rules with other matchers only ($contains) are always candidates. Candidates are returned in the order of rules,
+    so the first matching candidate is the same rule that a linear scan would pick.
+    """
+
+    def __init__(self, rules: List[ConfigRule]):
+        self._rules = rules
+        self._values_index: Dict[str, Dict[str, List[int]]] = {source: {} for source in _SOURCE_VALUE_EXTRACTOR_MAP}
+        self._prefixes_index: Dict[str, Dict] = {source: {} for source in _SOURCE_VALUE_EXTRACTOR_MAP}
+        self._residual: List[int] = []
+        for rule_number, rule in enumerate(rules):
+            self._add(rule_number, rule)
+
+    def _add(self, rule_number: int, rule: ConfigRule):
+        value_matcher = next((matcher for matcher in rule.source_matchers if matcher.comparator in (EQ_CONDITION, IN_CONDITION)), None)
+        if value_matcher:
+            values_index = self._values_index[value_matcher.source.casefold()]
+            for value in value_matcher.indexed_values():
+                values_index.setdefault(value, []).append(rule_number)
+            return
+
+        prefix_matcher = next((matcher for matcher in rule.source_matchers if matcher.comparator == PREFIX_CONDITION), None)
+        if prefix_matcher:
+            node = self._prefixes_index[prefix_matcher.source.casefold()]
+            for character in prefix_matcher.indexed_prefix():
+                node = node.setdefault(character, {})
+            node.setdefault(_TRIE_RULES_KEY, []).append(rule_number)
+            return
+
+        self._residual.append(rule_number)
+
+    def candidates(self, record: Dict, parsed_record: Dict) -> List[ConfigRule]:
+        rule_numbers = set(self._residual)
+        for source, source_value_extractor in _SOURCE_VALUE_EXTRACTOR_MAP.items():
+            value = str(source_value_extractor(record, parsed_record)).casefold()
+            rule_numbers.update(self._values_index[source].get(value, ()))
+            node = self._prefixes_index[source]
+            for character in value:
+                node = node.get(character, None)
+                if node is None:
+                    break
+                rule_numbers.update(node.get(_TRIE_RULES_KEY, ()))
+        return [self._rules[rule_number] for rule_number in sorted(rule_numbers)]
+
+
 class MetadataEngine:
     rules: List[ConfigRule]
     default_rule: ConfigRule = None
+    rule_index: RuleIndex
+    attribute_compile_failures: int = 0
 
     def __init__(self):
         self.rules = []
         self._load_configs()
+        self.rule_index = RuleIndex(self.rules)
+        # Rules match on source values only, so the selected rule can be memoized per source values
+        self._rule_cache = LruCache(RULE_CACHE_MAX_SIZE)
+        self.attribute_compile_failures = _count_attribute_compile_failures(self.rules + [self.default_rule])
+        if self.attribute_compile_failures:
+            logging.warning(f"Failed to precompile {self.attribute_compile_failures} rule attribute patterns, they will be evaluated on every record",
+                            "attribute-precompilation-warning")
 
     def _load_configs(self):
         working_directory = os.path.dirname(os.path.realpath(__file__))
@@ -118,18 +204,35 @@ class MetadataEngine:
                 logging.exception(f"Failed to load configuration file: '{config_file_path}'",
                                   "config-file-loading-exception")
 
-    def apply(self, record: Dict, parsed_record: Dict):
+    def apply(self, record: Dict, parsed_record: Dict, self_monitoring: Optional[SelfMonitoring] = None):
         try:
-            for rule in self.rules:
-                if _check_if_rule_applies(rule, record, parsed_record):
-                    _apply_rule(rule, record, parsed_record)
-                    return
-            # No matching rule has been found, applying the default rule
-            if self.default_rule:
-                _apply_rule(self.default_rule, record, parsed_record)
+            rule = self._select_rule(record, parsed_record, self_monitoring)
+            if rule:
+                _apply_rule(rule, record, parsed_record)
         except Exception:
             logging.exception("Encountered exception when running Rule Engine", "rule-engine-run-exception")
 
+    def _select_rule(self, record: Dict, parsed_record: Dict, self_monitoring: Optional[SelfMonitoring]) -> Optional[ConfigRule]:
+        source_values = _extract_source_values(record, parsed_record)
+        rule = self._rule_cache.get(source_values)
+        if rule is not MISSING:
+            if self_monitoring:
+                self_monitoring.rule_cache_hits += 1
+            return rule
+
+        if self_monitoring:
+            self_monitoring.rule_cache_misses += 1
+        # Default rule is applied when no matching rule has been found
+        rule = next((rule for rule in self.rule_index.candidates(record, parsed_record) if _check_if_rule_applies(rule, record, parsed_record)),
+                    self.default_rule)
+        self._rule_cache.put(source_values, rule)
+        return rule
+
+
+def _extract_source_values(record: Dict, parsed_record: Dict) -> Tuple[str, ...]:
+    # Matchers compare string representations of source values, so those identify the selected rule exactly
+    return tuple(str(source_value_extractor(record, parsed_record)) for source_value_extractor in _SOURCE_VALUE_EXTRACTOR_MAP.values())
+
 
 def _check_if_rule_applies(rule: ConfigRule, record: Dict, parsed_record: Dict):
     return all(matcher.match(record, parsed_record) for matcher in rule.source_matchers)
@@ -138,7 +241,7 @@ def _check_if_rule_applies(rule: ConfigRule, record: Dict, parsed_record: Dict):
 def _apply_rule(rule, record, parsed_record):
     for attribute in rule.attributes:
         try:
-            value = jmespath.search(attribute.pattern, record, JMESPATH_OPTIONS)
+            value = attribute.search(record)
             if value:
                 parsed_record[attribute.key] = value
         except Exception:
@@ -175,7 +278,7 @@ def _create_attributes(attributes_json: List[Dict]) -> List[Attribute]:
         pattern = source_json.get("pattern", None)
 
         if key and pattern:
-            result.append(Attribute(key, pattern))
+            result.append(Attribute(key, pattern, _compile_pattern(pattern)))
         else:
             logging.warning(f"Encountered invalid rule attribute with missing parameter, parameters were: key = {key}, pattern = {pattern}",
                             "attribute-missing-parameter-warning")
@@ -183,6 +286,18 @@ def _create_attributes(attributes_json: List[Dict]) -> List[Attribute]:
     return result
 
 
+def _compile_pattern(pattern: str) -> Optional[ParsedResult]:
+    try:
+        return jmespath.compile(pattern)
+    except Exception:
+        logging.exception(f"Failed to compile attribute pattern: '{pattern}'", "attribute-pattern-compilation-exception")
+        return None
+
+
+def _count_attribute_compile_failures(rules: List[Optional[ConfigRule]]) -> int:
+    return sum(1 for rule in rules if rule for attribute in rule.attributes if attribute.expression is None)
+
+
 def _create_config_rule(entity_name: str, rule_json: Dict) -> Optional[ConfigRule]:
     sources_json = rule_json.get("sources", [])
     if entity_name != "default" and not sources_json:
@@ -12,51 +12,112 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import ctypes
-import re
 import struct
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from logs_ingest.mapping import dt_me_type_mapper, RESOURCE_TYPE_ATTRIBUTE, RESOURCE_ID_ATTRIBUTE
-
-int64 = ctypes.c_int64 # pylint: disable=C0103
+from logs_ingest.mapping import dt_me_type_mapper, parse_resource_id, RESOURCE_TYPE_ATTRIBUTE, RESOURCE_ID_ATTRIBUTE
+from logs_ingest.self_monitoring import SelfMonitoring
+from .util.lru_cache import LruCache, MISSING
 
 CUSTOM_DEVICE_ENTITY_TYPE = "CUSTOM_DEVICE"
 MIN_RESOURCE_TYPE_LENGTH = 2
+ENTITY_ID_CACHE_MAX_SIZE = 4096
+
+_entity_attributes_cache = LruCache(ENTITY_ID_CACHE_MAX_SIZE)
 
 
-def infer_monitored_entity_id(category: str, parsed_record: Dict):
+def infer_monitored_entity_id(category: str, parsed_record: Dict, self_monitoring: Optional[SelfMonitoring] = None):
     resource_id: str = parsed_record.get(RESOURCE_ID_ATTRIBUTE, None)
-    resource_type: str = parsed_record.get(RESOURCE_TYPE_ATTRIBUTE, "").casefold()
+    resource_type: str = parsed_record.get(RESOURCE_TYPE_ATTRIBUTE, "")
 
     if not resource_id or not resource_type:
         return
 
+    # Entity attributes depend only on these values, and a batch refers to a limited number of resources
+    cache_key = (resource_type, category, resource_id)
+    entity_attributes = _entity_attributes_cache.get(cache_key)
+    if entity_attributes is MISSING:
+        if self_monitoring:
+            self_monitoring.entity_id_cache_misses += 1
+        entity_attributes = _create_entity_attributes(category, resource_id, resource_type.casefold())
+        _entity_attributes_cache.put(cache_key, entity_attributes)
+    elif self_monitoring:
+        self_monitoring.entity_id_cache_hits += 1
+
+    parsed_record.update(entity_attributes)
+
+
+def _create_entity_attributes(category: str, resource_id: str, resource_type: str) -> Tuple[Tuple[str, str], ...]:
     resource_type_with_category = ",".join([resource_type, category.casefold()])
     # Function App and Web app have the same resource type - AZURE_FUNCTION_APP meType can be difine only by resource type and log category combination
     dt_me_type = dt_me_type_mapper.get(resource_type_with_category, dt_me_type_mapper.get(resource_type, None))
 
-    resource_type_elements = resource_type.split("/")
-    if not dt_me_type and len(resource_type_elements) > MIN_RESOURCE_TYPE_LENGTH:
+    resource_type_segments = resource_type.split("/")
+    if not dt_me_type and len(resource_type_segments) > MIN_RESOURCE_TYPE_LENGTH:
         # If we get resourceType for subresource we will cut additional segments out to find Dynatrace MeType within supported resourceTypes.
         # If we don't find it, we won't calculate identifier and send it to Dynatrace.
         # e.g.
         # MICROSOFT.EVENTHUB/NAMESPACES/AUTHORIZATIONRULES -> we will find MICROSOFT.EVENTHUB/NAMESPACES as Dynatrace MeType
         # MICROSOFT.SQL/SERVERS/DATABASES/TESTMS-SQL-DB/AUDITINGSETTINGS/DEFAULT -> MICROSOFT.SQL/SERVERS/DATABASES
         # MICROSOFT.INSIGHTS/DIAGNOSTICSETTINGS -> identifier won't be calculated
-        while dt_me_type is None and len(resource_type_elements) > MIN_RESOURCE_TYPE_LENGTH:
-            resource_type_elements.pop()
-            resource_type = "/".join(resource_type_elements)
-            dt_me_type = dt_me_type_mapper.get(resource_type, None)
+        dt_me_type, prefix_length = _resource_type_trie.find_longest_prefix(resource_type_segments, MIN_RESOURCE_TYPE_LENGTH)
         if dt_me_type:
-            resource_id_pattern = re.compile(rf".*{resource_type.casefold()}/[^/]*", re.IGNORECASE)
-            resource_id = resource_id_pattern.match(resource_id).group(0) if resource_id_pattern.match(resource_id) else None
-
-    if dt_me_type and resource_id:
-        identifier = create_monitored_entity_id(dt_me_type, resource_id)
-        parsed_record["dt.source_entity"] = identifier
-        if dt_me_type.casefold() == CUSTOM_DEVICE_ENTITY_TYPE.casefold():
-            parsed_record["dt.entity.custom_device"] = identifier
+            resource_id = _cut_resource_id(resource_id, resource_type_segments[:prefix_length])
+
+    if not dt_me_type or not resource_id:
+        return ()
+    identifier = create_monitored_entity_id(dt_me_type, resource_id)
+    if dt_me_type.casefold() == CUSTOM_DEVICE_ENTITY_TYPE.casefold():
+        return ("dt.source_entity", identifier), ("dt.entity.custom_device", identifier)
+    return (("dt.source_entity", identifier),)
+
+
+class ResourceTypeTrie:
+    """
+    Resource types supported by dt_me_type_mapper (regardless of category) split into segments,
+    so that the longest supported prefix of a subresource type is found in a single walk over its segments.
+    """
+
+    def __init__(self, me_type_mapper: Dict[str, str]):
+        self._root: Dict = {}
+        for resource_type, me_type in me_type_mapper.items():
+            if "," in resource_type:
+                continue
+            node = self._root
+            for segment in resource_type.split("/"):
+                node = node.setdefault(segment, {})
+            node[None] = me_type  # None key holds meType of the resource type ending at the node
+
+    def find_longest_prefix(self, resource_type_segments: List[str], min_length: int) -> Tuple[Optional[str], int]:
+        """Returns meType and number of segments of the longest supported prefix shorter than the whole resource type"""
+        me_type, prefix_length = None, 0
+        node = self._root
+        for length, segment in enumerate(resource_type_segments[:-1], start=1):
+            node = node.get(segment)
+            if node is None:
+                break
+            if length >= min_length and None in node:
+                me_type, prefix_length = node[None], length
+        return me_type, prefix_length
+
+
+_resource_type_trie = ResourceTypeTrie(dt_me_type_mapper)
+
+
+def _cut_resource_id(resource_id: str, resource_type_segments: List[str]) -> Optional[str]:
+    """
+    Cuts resource ID after the name following the last occurrence of the resource type (matched case-insensitively), e.g.
+    .../PROVIDERS/MICROSOFT.EVENTHUB/NAMESPACES/LOGS-INGEST-EVENTHUB/AUTHORIZATIONRULES/ROOTMANAGESHAREDACCESSKEY, microsoft.eventhub/namespaces
+    -> .../PROVIDERS/MICROSOFT.EVENTHUB/NAMESPACES/LOGS-INGEST-EVENTHUB
+    """
+    resource_id_segments = parse_resource_id(resource_id).segments  # split once, when resource id attributes were extracted
+    casefolded_segments = [segment.casefold() for segment in resource_id_segments]
+    first_segment, next_segments = resource_type_segments[0], resource_type_segments[1:]
+    # Searched from the end, the name segment has to follow the resource type
+    for start in range(len(resource_id_segments) - len(resource_type_segments) - 1, -1, -1):
+        if casefolded_segments[start].endswith(first_segment) and casefolded_segments[start + 1:start + len(resource_type_segments)] == next_segments:
+            return "/".join(resource_id_segments[:start + len(resource_type_segments) + 1])
+    return None
 
 
 def create_monitored_entity_id(entity_type: str, resource_id: str) -> str:
@@ -65,56 +126,42 @@ def create_monitored_entity_id(entity_type: str, resource_id: str) -> str:
     return identifier
 
 
-def _zfrs(num, shift):
-    # Zero fill right shift.
-    return int64((num & 0xFFFFFFFFFFFFFFFF) >> shift).value
+def create_monitored_entity_ids(entity_type: str, resource_ids: Iterable[str]) -> List[str]:
+    """Bulk version of create_monitored_entity_id, for many resources of the same entity type"""
+    prefix = entity_type + "-"
+    return [f"{prefix}{_murmurhash2_64A(resource_id.lower().encode('UTF-8')) & MASK_64:016X}" for resource_id in resource_ids]
 
 
-def _murmurhash2_64A(data: bytes, seed=0xe17a1465):
-    # pylint: disable=C0103
-    buf = bytearray(data)
-    m = int64(0xc6a4a7935bd1e995).value
-    r = 47
-    offset = 0
-    length = len(buf)
+# MurmurHash64A on plain Python ints: every product is masked to 64 bits, which gives the same bits as the signed
+# 64-bit arithmetic of the reference implementation (Dynatrace computes entity IDs with Java longs)
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+MURMUR_M = 0xc6a4a7935bd1e995
+MURMUR_R = 47
+MURMUR_SEED = 0xe17a1465
 
-    h = int64(seed ^ ((length - offset) * m)).value
 
-    k = 0
-
-    while (length - offset) >= 8:
-        k = struct.unpack_from('<q', buf, offset)[0]
-        offset += 8
-
-        k = int64(k * m).value
-        k = int64(k ^ _zfrs(k, r)).value
-        k = int64(k * m).value
-
-        h = int64(h ^ k).value
-        h = int64(h * m).value
-
-    remaining = length - offset
-    if remaining > 0:
-        finish = bytearray(8)
-        finish[:remaining] = buf[offset:]
-
-        h = int64(h ^ struct.unpack_from('<q', finish)[0]).value
-        h = int64(h * m).value
+def _murmurhash2_64A(data: bytes, seed=MURMUR_SEED) -> int:
+    # pylint: disable=C0103
+    length = len(data)
+    number_of_blocks = length >> 3
+    h = (seed ^ (length * MURMUR_M)) & MASK_64
 
-    h = int64(h ^ _zfrs(h, r)).value
-    h = int64(h * m).value
-    h = int64(h ^ _zfrs(h, r)).value
-    return h
+    # all 8-byte blocks are unpacked with a single call
+    for k in struct.unpack_from(f"<{number_of_blocks}Q", data):
+        k = (k * MURMUR_M) & MASK_64
+        k ^= k >> MURMUR_R
+        k = (k * MURMUR_M) & MASK_64
+        h = ((h ^ k) * MURMUR_M) & MASK_64
 
+    if length & 7:
+        h = ((h ^ int.from_bytes(data[number_of_blocks << 3:], "little")) * MURMUR_M) & MASK_64
 
-HEX_DIGITS = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F']
+    h ^= h >> MURMUR_R
+    h = (h * MURMUR_M) & MASK_64
+    h ^= h >> MURMUR_R
+    # returned as signed 64-bit value, like the reference implementation
+    return h - (1 << 64) if h >> 63 else h
 
 
 def _encode_me_identifier(type_name: str, identifier: int) -> str:
-    string_id = type_name + "-"
-    i = 60
-    while i >= 0:
-        hex_digit_index = _zfrs(identifier, i) & 0xF
-        string_id += HEX_DIGITS[hex_digit_index]
-        i -= 4
-    return string_id
\ No newline at end of file
+    return f"{type_name}-{identifier & MASK_64:016X}"
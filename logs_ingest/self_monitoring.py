@@ -25,7 +25,7 @@ from logs_ingest.azure_credentials import get_azure_token
 from . import logging
 
 
-class SelfMonitoring:
+class SelfMonitoring:  # pylint: disable=R0902
 
     def __init__(self, execution_time: datetime):
         self.execution_time = execution_time.replace(microsecond=0)
@@ -38,6 +38,24 @@ class SelfMonitoring:
         self.sending_time: float = 0
         self.sent_log_entries: int = 0
         self.log_ingest_payload_size: float = 0
+        self.rule_cache_hits: int = 0
+        self.rule_cache_misses: int = 0
+        self.entity_id_cache_hits: int = 0
+        self.entity_id_cache_misses: int = 0
+        self.concurrent_send_calls_limit: int = 0
+        self.retried_requests: int = 0
+        self.json_repairs = Counter()
+
+    def merge(self, other: "SelfMonitoring"):
+        """Adds parsing statistics gathered by other SelfMonitoring, e.g. in a parsing process"""
+        self.too_old_records += other.too_old_records
+        self.parsing_errors += other.parsing_errors
+        self.too_long_content_size.extend(other.too_long_content_size)
+        self.json_repairs.update(other.json_repairs)
+        self.rule_cache_hits += other.rule_cache_hits
+        self.rule_cache_misses += other.rule_cache_misses
+        self.entity_id_cache_hits += other.entity_id_cache_hits
+        self.entity_id_cache_misses += other.entity_id_cache_misses
 
     def log_self_monitoring_data(self):
         dynatrace_connectivity = Counter(self.dynatrace_connectivities)
@@ -53,6 +71,12 @@ class SelfMonitoring:
         logging.info(f"SFM Log ingest payload size [kB]: {self.log_ingest_payload_size}")
         logging.info(f"SFM Total logs processing time [s]: {self.processing_time}")
         logging.info(f"SFM Total logs sending time [s]: {self.sending_time}")
+        logging.info(f"SFM Number of retried log ingest requests: {self.retried_requests}")
+        logging.info(f"SFM Concurrent log ingest requests limit: {self.concurrent_send_calls_limit}")
+        json_repairs = ", ".join(f"{repair_tier}:{count}" for repair_tier, count in self.json_repairs.items())
+        logging.info(f"SFM JSON repairs: {json_repairs}")
+        logging.info(f"SFM Metadata rule cache hits: {self.rule_cache_hits}, misses: {self.rule_cache_misses}")
+        logging.info(f"SFM Entity ID cache hits: {self.entity_id_cache_hits}, misses: {self.entity_id_cache_misses}")
 
     def push_time_series_to_azure(self):
         azure_token = get_azure_token()
@@ -108,6 +132,17 @@ class SelfMonitoring:
         if self.log_ingest_payload_size:
             self_monitoring_metrics.append(self.metric_data(time, "log_ingest_payload_size", self.log_ingest_payload_size, count=1))
 
+        for cache_metric in ["rule_cache_hits", "rule_cache_misses", "entity_id_cache_hits", "entity_id_cache_misses"]:
+            value = getattr(self, cache_metric)
+            if value:
+                self_monitoring_metrics.append(self.metric_data(time, cache_metric, value, count=value))
+
+        if self.retried_requests:
+            self_monitoring_metrics.append(self.metric_data(time, "retried_requests", self.retried_requests, count=self.retried_requests))
+
+        if self.concurrent_send_calls_limit:
+            self_monitoring_metrics.append(self.metric_data(time, "concurrent_send_calls_limit", self.concurrent_send_calls_limit, count=1))
+
         self_monitoring_metrics.append(self.metric_data(time, "processing_time", self.processing_time, count=1))
         self_monitoring_metrics.append(self.metric_data(time, "sending_time", self.sending_time, count=1))
 
@@ -132,6 +167,9 @@ class SelfMonitoring:
                 }
             )
 
+        self_monitoring_metrics.extend(self.dimension_metric_data(time, "json_repairs", "repair_tier", repair_tier, count)
+                                       for repair_tier, count in self.json_repairs.items())
+
         counter = Counter(self.dynatrace_connectivities)
         for element, count in counter.items():
             if element.name != DynatraceConnectivity.Ok.name:
@@ -181,6 +219,30 @@ class SelfMonitoring:
             }
         }
 
+    @staticmethod
+    def dimension_metric_data(time, name, dimension_name, dimension_value, count):
+        return {
+            "time": time,
+            "data": {
+                "baseData": {
+                    "metric": name,
+                    "namespace": "dynatrace_logs_self_monitoring",
+                    "dimNames": [dimension_name],
+                    "series": [
+                        {
+                            "dimValues": [
+                                dimension_value
+                            ],
+                            "min": count,
+                            "max": count,
+                            "sum": count,
+                            "count": count
+                        }
+                    ]
+                }
+            }
+        }
+
 
 # pylint: disable=C0103
 class DynatraceConnectivity(enum.Enum):
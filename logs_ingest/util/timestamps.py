@@ -0,0 +1,86 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import re
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from dateutil import parser
+
+from .lru_cache import LruCache, MISSING
+
+# e.g. 2021-03-01T12:00:00.1234567Z - Azure sends 7 fractional digits, datetime supports up to 6
+ISO_TIMESTAMP_WITH_LONG_FRACTION = re.compile(r'(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}\.\d{6})\d*(Z|[+-]\d{2}:?\d{2})?')
+# e.g. 03/01/2021 12:00:00 (month first)
+AZURE_TIMESTAMP = re.compile(r'(\d{2})/(\d{2})/(\d{4}) (\d{2}):(\d{2}):(\d{2})')
+# Records in Azure batches often share the timestamp, as it has seconds granularity
+TIMESTAMP_CACHE_MAX_SIZE = 1024
+
+_normalized_timestamps = LruCache(TIMESTAMP_CACHE_MAX_SIZE)
+
+
+class NormalizedTimestamp(NamedTuple):
+    epoch: float
+    text: str  # timestamp sent to Dynatrace
+
+
+def normalize_timestamp(timestamp: str) -> NormalizedTimestamp:
+    """
+    Parses the timestamp once into epoch seconds (used for the age check) and the text sent to Dynatrace -
+    ISO format for MM/DD/YYYY HH:MM:SS timestamps not accepted by Dynatrace, otherwise the original timestamp.
+    Raises ValueError (or TypeError) when the timestamp can't be parsed.
+    """
+    normalized_timestamp = _normalized_timestamps.get(timestamp)
+    if normalized_timestamp is MISSING:
+        date = parse_timestamp(timestamp)
+        text = date.replace(tzinfo=None).isoformat() + "Z" if AZURE_TIMESTAMP.fullmatch(timestamp) else timestamp
+        normalized_timestamp = NormalizedTimestamp(date.timestamp(), text)
+        _normalized_timestamps.put(timestamp, normalized_timestamp)
+    return normalized_timestamp
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    """
+    Parses timestamps sent by Azure without going through generic dateutil parser, which is much slower.
+    Timestamps without timezone are treated as UTC. Formats not handled here are still parsed with dateutil.
+    """
+    date = _parse_known_timestamp_format(timestamp) or parser.parse(timestamp)
+    if not date.tzinfo:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def _parse_known_timestamp_format(timestamp: str):
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        pass
+
+    iso_match = ISO_TIMESTAMP_WITH_LONG_FRACTION.fullmatch(timestamp)
+    if iso_match:
+        time_zone = iso_match.group(2) or ""
+        try:
+            return datetime.fromisoformat(iso_match.group(1) + ("+00:00" if time_zone == "Z" else time_zone))
+        except ValueError:
+            return None
+
+    azure_match = AZURE_TIMESTAMP.fullmatch(timestamp)
+    if azure_match:
+        month, day, year, hour, minute, second = (int(group) for group in azure_match.groups())
+        try:
+            return datetime(year, month, day, hour, minute, second)
+        except ValueError:
+            return None
+
+    return None
@@ -159,6 +159,7 @@ def test_main_server_error(monkeypatch: MonkeyPatchFixture, init_events, self_mo
     for variable_name, variable_value in system_variables.items():
         monkeypatch.setenv(variable_name, variable_value)
     monkeypatch.setattr(main, 'content_length_limit', 1000)
+    monkeypatch.setenv('DYNATRACE_LOG_INGEST_RETRY_TIME_BUDGET', '0')
 
     # when
     with pytest.raises(HTTPError):
@@ -12,7 +12,9 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from logs_ingest.mapping import extract_resource_id_attributes, RESOURCE_ID_ATTRIBUTE, SUBSCRIPTION_ATTRIBUTE, \
+import json
+
+from logs_ingest.mapping import extract_resource_id_attributes, parse_resource_id, RESOURCE_ID_ATTRIBUTE, SUBSCRIPTION_ATTRIBUTE, \
     RESOURCE_GROUP_ATTRIBUTE, RESOURCE_TYPE_ATTRIBUTE, RESOURCE_NAME_ATTRIBUTE
 
 
@@ -43,6 +45,31 @@ def test_extract_resource_id_attributes_invalid_resource_id():
     assert result_dict == {RESOURCE_ID_ATTRIBUTE: resource_id}
 
 
+def test_extract_resource_id_attributes_shares_values_between_records():
+    resource_id = "/SUBSCRIPTIONS/69B51384-146C-4685-9DAB-5AE01877D7B8/RESOURCEGROUPS/TESTMS/PROVIDERS/MICROSOFT.APIMANAGEMENT/SERVICE/WEATHERAPP-API-MGMT"
+    records = [{}, {}]
+    for record in records:
+        # as if decoded from different events - equal, but separate strings
+        extract_resource_id_attributes(record, json.loads(json.dumps(resource_id)))
+
+    assert records[0] == records[1] == {
+        RESOURCE_ID_ATTRIBUTE: resource_id,
+        SUBSCRIPTION_ATTRIBUTE: "69B51384-146C-4685-9DAB-5AE01877D7B8",
+        RESOURCE_GROUP_ATTRIBUTE: "TESTMS",
+        RESOURCE_NAME_ATTRIBUTE: "WEATHERAPP-API-MGMT",
+        RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.APIMANAGEMENT/SERVICE"
+    }
+    assert all(records[0][key] is records[1][key] for key in records[0])
+    assert parse_resource_id(resource_id).segments == tuple(resource_id.split("/"))
+
+
+def test_extract_resource_id_attributes_with_leading_slashes():
+    result_dict = {}
+    extract_resource_id_attributes(result_dict, "//subscriptions/a84d2d12/resourceGroups/rg-adagze/providers/Microsoft.Maps/accounts/maps-test")
+    assert result_dict[RESOURCE_TYPE_ATTRIBUTE] == "Microsoft.Maps/accounts"
+    assert result_dict[RESOURCE_NAME_ATTRIBUTE] == "maps-test"
+
+
 def run_successful_extraction_test(
         resource_id: str,
         expected_subscription: str,
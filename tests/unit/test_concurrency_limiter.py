@@ -0,0 +1,77 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import time
+
+from logs_ingest.concurrency_limiter import AdaptiveConcurrencyLimiter
+
+
+def test_limit_grows_after_window_of_healthy_responses():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=3)
+
+    for _ in range(2):
+        limiter.on_response(200, time.perf_counter())
+    assert limiter.limit == 3
+
+    for _ in range(10):
+        limiter.on_response(200, time.perf_counter())
+    assert limiter.limit == 3
+
+
+def test_limit_is_halved_once_per_burst_of_throttled_responses():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=1, max_limit=10)
+    burst_start_time = time.perf_counter()
+
+    for _ in range(4):
+        limiter.on_response(429, burst_start_time)
+    assert limiter.limit == 4
+
+    limiter.on_response(503, time.perf_counter())
+    assert limiter.limit == 2
+
+    limiter.on_failure(time.perf_counter())
+    limiter.on_failure(time.perf_counter())
+    assert limiter.limit == 1
+
+
+def test_limit_is_lowered_when_latency_rises():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=1, max_limit=10)
+    for _ in range(5):
+        limiter.on_response(200, time.perf_counter())
+
+    limiter.on_response(200, time.perf_counter() - 1)
+
+    assert limiter.limit == 5
+
+
+def test_acquire_waits_until_in_flight_requests_are_below_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=2)
+    in_flight = []
+    max_in_flight = []
+
+    async def request():
+        await limiter.acquire()
+        in_flight.append(1)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        await limiter.release()
+
+    async def run_requests():
+        await asyncio.gather(*[request() for _ in range(6)])
+
+    asyncio.run(run_requests())
+
+    assert max(max_in_flight) == 2
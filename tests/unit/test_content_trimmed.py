@@ -15,7 +15,7 @@ import json
 from datetime import datetime
 
 import logs_ingest.main
-from logs_ingest.main import parse_record
+from logs_ingest.main import parse_record, trim_content
 from logs_ingest.self_monitoring import SelfMonitoring
 
 log_message = "WALTHAM, Mass.--(BUSINESS WIRE)-- Software intelligence company Dynatrace (NYSE: DT) announced today its entry into the cloud application security market with the addition of a new module to its industry-leading Software Intelligence Platform. The Dynatrace® Application Security Module provides continuous runtime application self-protection (RASP) capabilities for applications in production as well as preproduction and is optimized for Kubernetes architectures and DevSecOps approaches. This module inherits the automation, AI, scalability, and enterprise-grade robustness of the Dynatrace® Software Intelligence Platform and extends it to modern cloud RASP use cases. Dynatrace customers can launch this module with the flip of a switch, empowering the world’s leading organizations currently using the Dynatrace platform to immediately increase security coverage and precision.;"
@@ -70,3 +70,46 @@ def test_content_with_exact_len_not_trimmed():
         "content": '{"content": "WALTHAM, Mass.--(BUSINESS WIRE)-- Software intelligence company Dynatrace (NYSE: DT)"}'
     }
     assert actual_output == expected_output
+
+
+def test_content_trimmed_to_utf8_bytes_on_character_boundary():
+    content_length_limit_backup = logs_ingest.main.content_length_limit
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    # given
+    content = "zażółć gęślą jaźń 日本語 \U0001F600 " * 10
+    logs_ingest.main.content_length_limit = 50
+
+    # when
+    try:
+        trimmed_contents = [trim_content(content[offset:], self_monitoring) for offset in range(10)]
+    finally:
+        # restore original value
+        logs_ingest.main.content_length_limit = content_length_limit_backup
+
+    # then
+    for offset, trimmed_content in enumerate(trimmed_contents):
+        assert trimmed_content.endswith("[TRUNCATED]")
+        assert 50 - 3 <= len(trimmed_content.encode("UTF-8")) <= 50
+        assert content[offset:].startswith(trimmed_content[:-len("[TRUNCATED]")])
+    assert self_monitoring.too_long_content_size == [len(content[offset:].encode("UTF-8")) for offset in range(10)]
+
+
+def test_non_ascii_content_within_byte_limit_not_trimmed():
+    content_length_limit_backup = logs_ingest.main.content_length_limit
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    # given
+    content = "zażółć gęślą jaźń"
+    logs_ingest.main.content_length_limit = len(content.encode("UTF-8"))
+
+    # when
+    try:
+        trimmed_content = trim_content(content, self_monitoring)
+    finally:
+        # restore original value
+        logs_ingest.main.content_length_limit = content_length_limit_backup
+
+    # then
+    assert trimmed_content == content
+    assert not self_monitoring.too_long_content_size
@@ -12,12 +12,23 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import asyncio
+import gzip
 import json
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from math import ceil
 from typing import NewType, Any
+from urllib.error import HTTPError
 
-from logs_ingest import dynatrace_client
+import aiohttp
+import pytest
+
+from logs_ingest import dynatrace_client, json_codec
+from logs_ingest.self_monitoring import SelfMonitoring
 
 log_message = "WALTHAM, Mass.--(BUSINESS WIRE)-- Software intelligence company Dynatrace (NYSE: DT) announced today its entry into the cloud application security market with the addition of a new module to its industry-leading Software Intelligence Platform. The Dynatrace® Application Security Module provides continuous runtime application self-protection (RASP) capabilities for applications in production as well as preproduction and is optimized for Kubernetes architectures and DevSecOps approaches. This module inherits the automation, AI, scalability, and enterprise-grade robustness of the Dynatrace® Software Intelligence Platform and extends it to modern cloud RASP use cases. Dynatrace customers can launch this module with the flip of a switch, empowering the world’s leading organizations currently using the Dynatrace platform to immediately increase security coverage and precision.;"
 
@@ -84,3 +95,365 @@ def test_prepare_serialized_batches_split_by_events_limit(monkeypatch: MonkeyPat
         entries_in_batches += len(json.loads(batch_log))
 
     assert entries_in_batches == how_many_logs
+
+
+def test_send_logs_sends_batches_while_logs_are_parsed(monkeypatch: MonkeyPatchFixture):
+    max_events = 5
+    how_many_logs = 50
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", str(max_events))
+    timeline = []
+
+    def parse_logs():
+        for i in range(how_many_logs):
+            timeline.append(f"parsed {i}")
+            yield create_log_entry_with_random_len_msg()
+
+    async def perform_http_request(*_args, **_kwargs):
+        timeline.append("sent")
+        return 200, "OK", "", {}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", parse_logs(), self_monitoring))
+
+    assert timeline.count("sent") == ceil(how_many_logs / max_events)
+    assert timeline.index("sent") < timeline.index(f"parsed {how_many_logs - 1}")
+    assert self_monitoring.sent_log_entries == how_many_logs
+
+
+def test_prepare_serialized_batches_fills_batch_up_to_exact_size(monkeypatch: MonkeyPatchFixture):
+    logs = [{'content': 'ą' * 10}, {'content': 'ę' * 10}, {'content': 'ś' * 10}]
+    entry_size = len(json_codec.dumps(logs[0]))
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", str(2 * entry_size + 3))  # brackets and one comma
+
+    batches = dynatrace_client.prepare_serialized_batches(logs)
+
+    assert [batch.number_of_logs_in_batch for batch in batches] == [2, 1]
+    assert len(batches[0].serialized_batch) == 2 * entry_size + 3
+    assert json.loads(batches[0].serialized_batch) + json.loads(batches[1].serialized_batch) == logs
+
+
+def test_prepare_serialized_batches_with_streaming_compression(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "7")
+    monkeypatch.setattr(dynatrace_client, "streaming_compression_enabled", True)
+    logs = [create_log_entry_with_random_len_msg() for x in range(20)]
+
+    batches = dynatrace_client.prepare_serialized_batches(logs)
+
+    assert all(batch.compressed for batch in batches)
+    decompressed_batches = [gzip.decompress(batch.serialized_batch) for batch in batches]
+    assert [len(decompressed_batch) for decompressed_batch in decompressed_batches] == [batch.uncompressed_size for batch in batches]
+    assert [log for decompressed_batch in decompressed_batches for log in json.loads(decompressed_batch)] == logs
+
+
+def test_send_logs_compresses_batches_in_thread_pool(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "10")
+    logs = [create_log_entry_with_random_len_msg() for x in range(30)]
+    compression_threads = []
+    sent_logs = []
+
+    def compress(data, compresslevel):
+        compression_threads.append(threading.current_thread().name)
+        return gzip_compress(data, compresslevel)
+
+    async def perform_http_request(*_args, **kwargs):
+        sent_logs.extend(json.loads(gzip.decompress(kwargs["encoded_body_bytes"])))
+        return 200, "OK", "", {}
+
+    gzip_compress = gzip.compress
+    monkeypatch.setattr(gzip, "compress", compress)
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, SelfMonitoring(execution_time=datetime.utcnow())))
+
+    assert len(compression_threads) == 3
+    assert all(thread_name.startswith("logs-compression") for thread_name in compression_threads)
+    assert sorted(sent_logs, key=json.dumps) == sorted(logs, key=json.dumps)
+
+
+def test_session_is_reused_between_executions(monkeypatch: MonkeyPatchFixture):
+    sessions = []
+
+    async def perform_http_request(session, *_args, **_kwargs):
+        sessions.append(session)
+        return 200, "OK", "", {}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+
+    for _ in range(2):
+        logs = [create_log_entry_with_random_len_msg()]
+        dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, SelfMonitoring(execution_time=datetime.utcnow())))
+
+    assert len(sessions) == 2
+    assert sessions[0] is sessions[1]
+    assert not sessions[0].closed
+
+
+def test_send_logs_retries_once_on_closed_keep_alive_connection(monkeypatch: MonkeyPatchFixture):
+    requests = []
+
+    async def perform_http_request(*_args, **_kwargs):
+        requests.append(1)
+        if len(requests) == 1:
+            raise aiohttp.ServerDisconnectedError()
+        return 200, "OK", "", {}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(
+        dynatrace_client.send_logs("http://localhost", "token", [create_log_entry_with_random_len_msg()], self_monitoring))
+
+    assert len(requests) == 2
+    assert self_monitoring.sent_log_entries == 1
+
+    # connection error repeated on the new connection fails the batch
+    async def disconnect(*_args, **_kwargs):
+        requests.append(1)
+        raise aiohttp.ServerDisconnectedError()
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", disconnect)
+    requests.clear()
+
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        dynatrace_client.run_in_sender_loop(
+            dynatrace_client.send_logs("http://localhost", "token", [create_log_entry_with_random_len_msg()], self_monitoring))
+    assert len(requests) == 2
+
+
+def test_send_logs_lowers_concurrency_limit_when_throttled(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_RETRY_TIME_BUDGET", "0")
+    monkeypatch.setattr("logs_ingest.dynatrace_client._sender_state.concurrency_limit", 8, raising=False)
+    logs = [create_log_entry_with_random_len_msg() for x in range(8)]
+    requests = []
+
+    async def perform_http_request(*_args, **_kwargs):
+        requests.append(1)
+        # respond only when all requests have been sent, as a single burst
+        while len(requests) < len(logs):
+            await asyncio.sleep(0.001)
+        return 429, "Too Many Requests", "", {}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    with pytest.raises(HTTPError):
+        dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, self_monitoring))
+
+    # whole burst of throttled requests halves the limit once
+    assert self_monitoring.concurrent_send_calls_limit == 4
+
+    # next execution starts from the lowered limit
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", lambda *_args, **_kwargs: asyncio.sleep(0, (200, "OK", "", {})))
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs[:1], self_monitoring))
+    assert self_monitoring.concurrent_send_calls_limit == 4
+
+
+def test_send_logs_doesnt_count_waiting_for_compression_as_latency(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setattr("logs_ingest.dynatrace_client._sender_state.concurrency_limit", 8, raising=False)
+    compression_executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(dynatrace_client, "compression_executor", compression_executor)
+    logs = [create_log_entry_with_random_len_msg() for x in range(8)]
+    latencies = []
+
+    def compress(data, compresslevel):
+        # batches queue up for the only compression thread
+        time.sleep(0.05)
+        return gzip_compress(data, compresslevel)
+
+    def on_response(_limiter, _status, request_start_time):
+        latencies.append(time.perf_counter() - request_start_time)
+
+    gzip_compress = gzip.compress
+    monkeypatch.setattr(gzip, "compress", compress)
+    monkeypatch.setattr(dynatrace_client.AdaptiveConcurrencyLimiter, "on_response", on_response)
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", lambda *_args, **_kwargs: asyncio.sleep(0, (200, "OK", "", {})))
+
+    try:
+        dynatrace_client.run_in_sender_loop(
+            dynatrace_client.send_logs("http://localhost", "token", logs, SelfMonitoring(execution_time=datetime.utcnow())))
+    finally:
+        compression_executor.shutdown()
+
+    assert len(latencies) == len(logs)
+    assert max(latencies) < 0.05
+
+
+def test_send_logs_retries_failed_batch(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "2")
+    logs = [create_log_entry_with_random_len_msg() for x in range(4)]
+    responses = iter([(429, "Too Many Requests", "", {"Retry-After": "0"}), (503, "Service Unavailable", "", {})])
+    sent_logs = []
+    delays = []
+
+    async def perform_http_request(*_args, **kwargs):
+        status, reason, text, headers = next(responses, (200, "OK", "", {}))
+        if status == 200:
+            sent_logs.extend(json.loads(gzip.decompress(kwargs["encoded_body_bytes"])))
+        return status, reason, text, headers
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    monkeypatch.setattr(dynatrace_client.asyncio, "sleep", sleep)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, self_monitoring))
+
+    assert sorted(sent_logs, key=json.dumps) == sorted(logs, key=json.dumps)
+    assert self_monitoring.sent_log_entries == 4
+    assert self_monitoring.retried_requests == 2
+    assert delays.count(0) >= 1
+    assert all(0 <= delay <= dynatrace_client.RETRY_MAX_BACKOFF for delay in delays)
+
+
+def test_send_logs_fails_when_retry_time_budget_is_exhausted(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_RETRY_TIME_BUDGET", "5")
+    requests = []
+
+    async def perform_http_request(*_args, **_kwargs):
+        requests.append(1)
+        return 429, "Too Many Requests", "", {"Retry-After": "60"}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    with pytest.raises(HTTPError):
+        logs = [create_log_entry_with_random_len_msg()]
+        dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, self_monitoring))
+
+    assert len(requests) == 1
+    assert self_monitoring.retried_requests == 0
+
+
+def test_retry_time_budget_starts_at_first_failure(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_RETRY_TIME_BUDGET", "1")
+    responses = iter([(429, "Too Many Requests", "", {"Retry-After": "0"})])
+
+    def parse_logs():
+        # parsing takes longer than the whole budget
+        time.sleep(1.1)
+        yield create_log_entry_with_random_len_msg()
+
+    async def perform_http_request(*_args, **_kwargs):
+        return next(responses, (200, "OK", "", {}))
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", parse_logs(), self_monitoring))
+
+    assert self_monitoring.retried_requests == 1
+    assert self_monitoring.sent_log_entries == 1
+
+
+def test_batch_waiting_for_retry_holds_concurrency_slot(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setattr("logs_ingest.dynatrace_client._sender_state.concurrency_limit", 1, raising=False)
+    logs = [{"content": "first"}, {"content": "second"}]
+    responses = iter([(429, "Too Many Requests", "", {"Retry-After": "0.05"})])
+    sent = []
+
+    async def perform_http_request(*_args, **kwargs):
+        status, reason, text, headers = next(responses, (200, "OK", "", {}))
+        if status == 200:
+            sent.extend(log["content"] for log in json.loads(gzip.decompress(kwargs["encoded_body_bytes"])))
+        return status, reason, text, headers
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", logs, self_monitoring))
+
+    # throttled batch keeps its slot while waiting, the next one is sent after it
+    assert sent == ["first", "second"]
+    assert self_monitoring.retried_requests == 1
+
+
+def test_send_logs_with_parsing_thread_sends_while_logs_are_parsed(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setattr(dynatrace_client, "parsing_thread_enabled", True)
+    monkeypatch.setattr(dynatrace_client, "parsed_batches_queue_size", 1)
+    how_many_logs = 20
+    first_request_sent = threading.Event()
+    parsing_threads = set()
+    parsed_ahead = []
+    sent = []
+
+    def parse_logs():
+        for i in range(how_many_logs):
+            parsing_threads.add(threading.current_thread())
+            parsed_ahead.append(len(parsed_ahead) + 1 - len(sent))
+            yield create_log_entry_with_random_len_msg()
+            if i == 1:
+                # the first batch is closed by the second log - it's sent while parsing is blocked here
+                assert first_request_sent.wait(timeout=5)
+
+    async def perform_http_request(*_args, **_kwargs):
+        sent.append(1)
+        first_request_sent.set()
+        await asyncio.sleep(0.001)
+        return 200, "OK", "", {}
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    dynatrace_client.run_in_sender_loop(dynatrace_client.send_logs("http://localhost", "token", parse_logs(), self_monitoring))
+
+    assert self_monitoring.sent_log_entries == how_many_logs
+    assert parsing_threads and threading.current_thread() not in parsing_threads
+    # parsing waits for sending: batches in flight, in the queue, being put to the queue and being built
+    assert max(parsed_ahead) <= dynatrace_client.max_concurrent_send_calls + 3
+
+
+def test_send_logs_with_parsing_thread_raises_parsing_exception(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setattr(dynatrace_client, "parsing_thread_enabled", True)
+
+    def parse_logs():
+        yield create_log_entry_with_random_len_msg()
+        raise ValueError("parsing failed")
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", lambda *_args, **_kwargs: asyncio.sleep(0, (200, "OK", "", {})))
+
+    with pytest.raises(ValueError):
+        dynatrace_client.run_in_sender_loop(
+            dynatrace_client.send_logs("http://localhost", "token", parse_logs(), SelfMonitoring(execution_time=datetime.utcnow())))
+
+
+def test_send_logs_with_parsing_thread_stops_parsing_when_sending_is_cancelled(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("DYNATRACE_LOG_INGEST_REQUEST_MAX_EVENTS", "1")
+    monkeypatch.setattr(dynatrace_client, "parsing_thread_enabled", True)
+    monkeypatch.setattr(dynatrace_client, "parsed_batches_queue_size", 1)
+    parsing_executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(dynatrace_client, "parsing_executor", parsing_executor)
+
+    def parse_logs():
+        for i in range(100):
+            if i == 3:
+                # sending is cancelled while this batch is being parsed
+                time.sleep(0.4)
+            yield create_log_entry_with_random_len_msg()
+
+    async def perform_http_request(*_args, **_kwargs):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(dynatrace_client, "_perform_http_request", perform_http_request)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            dynatrace_client.run_in_sender_loop(
+                asyncio.wait_for(dynatrace_client.send_logs("http://localhost", "token", parse_logs(), self_monitoring), timeout=0.2))
+
+        # parsing thread isn't left waiting for the event loop with logs of this execution
+        parsing_executor.submit(lambda: None).result(timeout=1)
+        assert self_monitoring.sent_log_entries == 0
+    finally:
+        parsing_executor.shutdown(wait=False)
@@ -191,3 +191,28 @@ def test_filter_global_with_only_bad_conditions():
     os.environ["FILTER_CONFIG"] = "FILTER.GLOBAL.CONTAINS_PATTERN=*bad* | *not_fitting_anything*"
     log_filter = LogFilter()
     assert log_filter.should_filter_out_record(parsed_record)
+
+
+def test_filters_of_scope_are_compiled(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("FILTER_CONFIG", "FILTER.GLOBAL.MIN_LOG_LEVEL=3;FILTER.GLOBAL.CONTAINS_PATTERN=*SQL* | Executed*")
+    log_filter = LogFilter()
+    global_filter = log_filter.filters_dict["global"]
+    assert global_filter.severities == {"Critical", "Error", "Warning"}
+    assert global_filter.content_pattern.match("Executed query")
+    assert global_filter.content_pattern.match("Failed SQL query")
+    assert not global_filter.content_pattern.match("Failed query")
+
+
+def test_resource_id_filter_takes_precedence_over_resource_type_and_global(monkeypatch: MonkeyPatchFixture):
+    monkeypatch.setenv("FILTER_CONFIG", "FILTER.GLOBAL.CONTAINS_PATTERN=*not_fitting*;"
+                                        "FILTER.RESOURCE_TYPE.MIN_LOG_LEVEL.MICROSOFT.WEB/SITES=1;"
+                                        f"FILTER.RESOURCE_ID.CONTAINS_PATTERN.{parsed_record['azure.resource.id']}=*logs_ingest*")
+    log_filter = LogFilter()
+    other_resource_record = {**parsed_record, "azure.resource.id": parsed_record["azure.resource.id"] + "2"}
+    other_type_record = {**other_resource_record, "azure.resource.type": "MICROSOFT.WEB/SERVERFARMS"}
+
+    for _ in range(2):
+        assert not log_filter.should_filter_out_record(parsed_record)
+        assert log_filter.should_filter_out_record(other_resource_record)
+        assert not log_filter.should_filter_out_record({**other_resource_record, "severity": "Critical"})
+        assert log_filter.should_filter_out_record({**other_type_record, "severity": "Critical"})
@@ -0,0 +1,79 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import random
+
+import orjson
+import pytest
+
+from logs_ingest import json_codec
+
+records = [
+    {"content": "plain ascii", "severity": "INFO", "cloud.provider": "Azure"},
+    {"content": "zażółć gęślą jaźń 日本語 \U0001F600", "timestamp": "2021-03-01T12:34:56.1234567Z"},
+    {"content": "quotes \" backslashes \\ control \n\t\x01  ", "azure.resource.id": "/SUBSCRIPTIONS/A/B"},
+    {"content": "", "int": 42, "float": 0.1, "big": 2 ** 70, "negative": -1.5e-300, "bool": True, "none": None},
+    {"content": {"nested": [1, "2", {"3": [None]}]}, 7: "non-string key"},
+]
+
+
+@pytest.mark.parametrize("orjson_module", [orjson, None], ids=["orjson", "json"])
+def test_dumps_decodes_to_same_value_as_stdlib(monkeypatch, orjson_module):
+    monkeypatch.setattr(json_codec, "orjson", orjson_module)
+    random_records = [{"content": "".join(chr(random.randint(1, 0x2FFF)) for _ in range(50))} for _ in range(100)]
+
+    for record in records + random_records:
+        serialized = json_codec.dumps(record)
+
+        assert isinstance(serialized, bytes)
+        assert json.loads(serialized) == json.loads(json.dumps(record))
+
+
+
+def test_orjson_is_the_default_backend():
+    assert json_codec.orjson is orjson
+    assert json_codec.JSON_BACKEND == "orjson"
+
+def test_dumps_without_orjson_is_stdlib_output(monkeypatch):
+    monkeypatch.setattr(json_codec, "orjson", None)
+
+    for record in records:
+        assert json_codec.dumps(record) == json.dumps(record).encode("UTF-8")
+
+
+@pytest.mark.parametrize("text", [
+    '{"records": [{"a": 1}, {"b": [1, 2, {"c": "d"}]}, "text", 3.5, null]}',
+    ' { "other" : {"records": [1]} ,\n "records" : [ {"zażółć": "\\u0105\\n"} ] , "x": NaN }\n',
+    '{"records": []}',
+    '{"records": [{"a": 1}], "records": [{"b": 2}]}',
+])
+def test_loads_with_raw_items(text):
+    obj, raw_items = json_codec.loads_with_raw_items(text, "records")
+
+    assert obj == json.loads(text) or json.dumps(obj) == json.dumps(json.loads(text))
+    assert [json.loads(raw_item) for raw_item in raw_items] == obj["records"]
+    assert all(raw_item in text for raw_item in raw_items)
+
+
+def test_loads_with_raw_items_without_array():
+    assert json_codec.loads_with_raw_items('{}', "records") == ({}, None)
+    assert json_codec.loads_with_raw_items('{"records": {"a": 1}}', "records") == ({"records": {"a": 1}}, None)
+    assert json_codec.loads_with_raw_items('{"records": [1], "records": 2}', "records") == ({"records": 2}, None)
+
+
+@pytest.mark.parametrize("text", ['', '[]', '{"records": [1,]}', "{'records': []}", '{"records": [1]} x', '{"a" 1}', '{"a": 1,}'])
+def test_loads_with_raw_items_rejects_invalid_json(text):
+    with pytest.raises(ValueError):
+        json_codec.loads_with_raw_items(text, "records")
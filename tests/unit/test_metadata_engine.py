@@ -12,8 +12,11 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from datetime import datetime
+
 from logs_ingest.mapping import RESOURCE_TYPE_ATTRIBUTE
-from logs_ingest.metadata_engine import SourceMatcher, _create_config_rule
+from logs_ingest.metadata_engine import SourceMatcher, _create_config_rule, MetadataEngine, RuleIndex, _check_if_rule_applies
+from logs_ingest.self_monitoring import SelfMonitoring
 
 
 def test_resource_type_eq_source_matcher():
@@ -69,4 +72,79 @@ def test_default_rule_can_have_no_sources():
     rule_json = {
         "sources": []
     }
-    assert _create_config_rule("default", rule_json)
\ No newline at end of file
+    assert _create_config_rule("default", rule_json)
+
+
+def test_attribute_patterns_are_precompiled():
+    rule_json = {
+        "sources": [{"sourceType": "logs", "source": "category", "condition": "$eq('TEST')"}],
+        "attributes": [{"key": "log.source", "pattern": "category"}, {"key": "invalid", "pattern": "properties.["}]
+    }
+    rule = _create_config_rule("TEST", rule_json)
+    assert rule.attributes[0].expression
+    assert rule.attributes[0].search({"category": "TEST"}) == "TEST"
+    assert not rule.attributes[1].expression
+
+
+def test_all_config_attribute_patterns_compile():
+    metadata_engine = MetadataEngine()
+    assert metadata_engine.attribute_compile_failures == 0
+
+
+def create_rule(name: str, *sources):
+    return _create_config_rule(name, {"sources": [{"source": source, "condition": condition} for source, condition in sources]})
+
+
+def test_rule_index_preserves_rules_order():
+    rules = [
+        create_rule("CONTAINS", ("resourceType", "$contains('SQL')")),
+        create_rule("PREFIX", ("resourceType", "$prefix('MICROSOFT.SQL/')"), ("category", "$eq('Errors')")),
+        create_rule("IN", ("category", "$in('Errors', 'Timeouts')")),
+        create_rule("EQ", ("resourceType", "$eq('microsoft.sql/servers')")),
+    ]
+    rule_index = RuleIndex(rules)
+
+    candidates = rule_index.candidates({"category": "ERRORS"}, {RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.SQL/SERVERS"})
+    assert [rule.entity_type_name for rule in candidates] == ["CONTAINS", "PREFIX", "IN", "EQ"]
+
+    candidates = rule_index.candidates({"category": "Timeouts"}, {RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.WEB/SITES"})
+    assert [rule.entity_type_name for rule in candidates] == ["CONTAINS", "IN"]
+
+    candidates = rule_index.candidates({}, {})
+    assert [rule.entity_type_name for rule in candidates] == ["CONTAINS"]
+
+
+def test_rule_index_selects_same_rule_as_linear_scan():
+    metadata_engine = MetadataEngine()
+    resource_types = {matcher.indexed_prefix() for rule in metadata_engine.rules for matcher in rule.source_matchers if matcher.source == "resourceType"}
+    categories = {matcher.indexed_prefix() for rule in metadata_engine.rules for matcher in rule.source_matchers if matcher.source == "category"}
+    resource_types = {value for values in resource_types for value in values.split(",")} | {"", "MICROSOFT.WEB/SERVERFARMS"}
+    categories = {value for values in categories for value in values.split(",")} | {"", "AppServiceHTTPLogs"}
+
+    for resource_type in resource_types:
+        for category in categories:
+            record = {"category": category.upper()}
+            parsed_record = {RESOURCE_TYPE_ATTRIBUTE: resource_type}
+            expected_rule = next((rule for rule in metadata_engine.rules if _check_if_rule_applies(rule, record, parsed_record)), None)
+            actual_rule = next((rule for rule in metadata_engine.rule_index.candidates(record, parsed_record)
+                                if _check_if_rule_applies(rule, record, parsed_record)), None)
+            assert actual_rule is expected_rule
+
+
+def test_selected_rule_is_cached_per_source_values():
+    metadata_engine = MetadataEngine()
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    record = {"category": "FunctionAppLogs", "properties": {"functionName": "logs_ingest"}}
+
+    for _ in range(3):
+        parsed_record = {RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.WEB/SITES"}
+        metadata_engine.apply(record, parsed_record, self_monitoring)
+        assert parsed_record["faas.name"] == "logs_ingest"
+
+    parsed_record = {RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.WEB/SERVERFARMS"}
+    metadata_engine.apply(record, parsed_record, self_monitoring)
+    assert "faas.name" not in parsed_record
+    assert parsed_record["log.source"] == "FunctionAppLogs"
+
+    assert self_monitoring.rule_cache_hits == 2
+    assert self_monitoring.rule_cache_misses == 2
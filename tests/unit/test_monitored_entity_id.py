@@ -12,8 +12,16 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from logs_ingest.mapping import RESOURCE_ID_ATTRIBUTE, RESOURCE_TYPE_ATTRIBUTE
-from logs_ingest.monitored_entity_id import create_monitored_entity_id, infer_monitored_entity_id
+import ctypes
+import random
+import re
+import struct
+from datetime import datetime
+
+from logs_ingest.mapping import RESOURCE_ID_ATTRIBUTE, RESOURCE_TYPE_ATTRIBUTE, dt_me_type_mapper
+from logs_ingest.monitored_entity_id import create_monitored_entity_id, infer_monitored_entity_id, create_monitored_entity_ids
+from logs_ingest.self_monitoring import SelfMonitoring
+from logs_ingest.util.lru_cache import LruCache
 
 custom_device_id_pairs = [
     (
@@ -122,4 +130,133 @@ def test_not_create_monitored_entity_id():
     }
     infer_monitored_entity_id("", record)
     assert "dt.entity.custom_device" not in record
-    assert "dt.source_entity" not in record
\ No newline at end of file
+    assert "dt.source_entity" not in record
+
+
+def test_monitored_entity_id_is_cached(monkeypatch):
+    monkeypatch.setattr("logs_ingest.monitored_entity_id._entity_attributes_cache", LruCache(2))
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    records = [{RESOURCE_ID_ATTRIBUTE: resource_id, RESOURCE_TYPE_ATTRIBUTE: "Microsoft.Web/serverFarms"}
+               for resource_id, _ in custom_device_id_pairs[:2] * 3]
+    records.append({RESOURCE_ID_ATTRIBUTE: custom_device_id_pairs[0][0], RESOURCE_TYPE_ATTRIBUTE: "MICROSOFT.INSIGHTS/DIAGNOSTICSETTINGS"})
+    records.append(dict(records[-1]))
+
+    for record in records:
+        infer_monitored_entity_id("", record, self_monitoring)
+
+    assert [record.get("dt.entity.custom_device") for record in records] == [item[1] for item in custom_device_id_pairs[:2]] * 3 + [None, None]
+    assert all(record.get("dt.source_entity") == record.get("dt.entity.custom_device") for record in records)
+    assert self_monitoring.entity_id_cache_misses == 3
+    assert self_monitoring.entity_id_cache_hits == 5
+
+
+def test_create_monitored_entity_ids():
+    resource_ids = [item[0] for item in custom_device_id_pairs]
+    assert create_monitored_entity_ids("CUSTOM_DEVICE", resource_ids) == [item[1] for item in custom_device_id_pairs]
+
+
+def test_create_monitored_entity_id_matches_legacy_implementation():
+    fuzz = random.Random(20211)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_./ łżśćąęŁŻ日本\u00ff"
+    resource_ids = [item[0] for item in custom_device_id_pairs] + [item[1] for item in legacy_id_triplets]
+    resource_ids += ["".join(fuzz.choices(alphabet, k=length)) for length in range(0, 64)]
+    resource_ids += ["".join(fuzz.choices(alphabet, k=fuzz.randint(0, 300))) for _ in range(3000)]
+
+    expected_ids = [legacy_create_monitored_entity_id("AZURE_WEB_APP", resource_id) for resource_id in resource_ids]
+
+    assert [create_monitored_entity_id("AZURE_WEB_APP", resource_id) for resource_id in resource_ids] == expected_ids
+    assert create_monitored_entity_ids("AZURE_WEB_APP", resource_ids) == expected_ids
+
+
+def test_subresource_entity_id_matches_legacy_implementation():
+    fuzz = random.Random(20212)
+    supported_types = [resource_type for resource_type in dt_me_type_mapper if "," not in resource_type]
+    extra_segments = ["authorizationrules", "databases", "default", "auditingsettings", "eventhubs", "x"]
+
+    def random_case(text):
+        return "".join(char.upper() if fuzz.random() < 0.5 else char for char in text)
+
+    for _ in range(3000):
+        type_segments = fuzz.choice(supported_types).split("/") + fuzz.choices(extra_segments, k=fuzz.randint(0, 3))
+        if fuzz.random() < 0.2:
+            type_segments[fuzz.randrange(len(type_segments))] = "unknown"
+        id_segments = ["", "subscriptions", "69b51384", "resourceGroups", "rg", "providers"]
+        for segment in type_segments:
+            id_segments += [segment] if fuzz.random() < 0.1 else [segment, f"name-{fuzz.randint(0, 9)}"]
+        if fuzz.random() < 0.3:
+            # resource type repeated in the name of a child resource
+            id_segments += type_segments[:fuzz.randint(1, len(type_segments))] + fuzz.choice([[], ["child"], [""]])
+        record = {RESOURCE_ID_ATTRIBUTE: random_case("/".join(id_segments)), RESOURCE_TYPE_ATTRIBUTE: random_case("/".join(type_segments))}
+        expected_record = dict(record)
+
+        infer_monitored_entity_id("", record)
+        legacy_infer_monitored_entity_id(expected_record)
+
+        assert record == expected_record
+
+
+# Previous implementation, emulating Java long arithmetic with ctypes - reference for the one based on masked integers
+
+def legacy_create_monitored_entity_id(entity_type: str, resource_id: str) -> str:
+    long_id = legacy_murmurhash2_64a(resource_id.lower().encode("UTF-8"))
+    string_id = entity_type + "-"
+    i = 60
+    while i >= 0:
+        string_id += "0123456789ABCDEF"[legacy_zfrs(long_id, i) & 0xF]
+        i -= 4
+    return string_id
+
+
+def legacy_zfrs(num, shift):
+    return ctypes.c_int64((num & 0xFFFFFFFFFFFFFFFF) >> shift).value
+
+
+def legacy_murmurhash2_64a(data: bytes, seed=0xe17a1465):
+    int64 = ctypes.c_int64
+    buf = bytearray(data)
+    m = int64(0xc6a4a7935bd1e995).value
+    r = 47
+    offset = 0
+    length = len(buf)
+    h = int64(seed ^ ((length - offset) * m)).value
+
+    while (length - offset) >= 8:
+        k = struct.unpack_from('<q', buf, offset)[0]
+        offset += 8
+        k = int64(k * m).value
+        k = int64(k ^ legacy_zfrs(k, r)).value
+        k = int64(k * m).value
+        h = int64(h ^ k).value
+        h = int64(h * m).value
+
+    remaining = length - offset
+    if remaining > 0:
+        finish = bytearray(8)
+        finish[:remaining] = buf[offset:]
+        h = int64(h ^ struct.unpack_from('<q', finish)[0]).value
+        h = int64(h * m).value
+
+    h = int64(h ^ legacy_zfrs(h, r)).value
+    h = int64(h * m).value
+    h = int64(h ^ legacy_zfrs(h, r)).value
+    return h
+
+
+def legacy_infer_monitored_entity_id(parsed_record):
+    resource_id = parsed_record[RESOURCE_ID_ATTRIBUTE]
+    resource_type = parsed_record[RESOURCE_TYPE_ATTRIBUTE].casefold()
+    dt_me_type = dt_me_type_mapper.get(resource_type, None)
+    resource_type_elements = resource_type.split("/")
+    if not dt_me_type and len(resource_type_elements) > 2:
+        while dt_me_type is None and len(resource_type_elements) > 2:
+            resource_type_elements.pop()
+            resource_type = "/".join(resource_type_elements)
+            dt_me_type = dt_me_type_mapper.get(resource_type, None)
+        if dt_me_type:
+            resource_id_pattern = re.compile(rf".*{resource_type.casefold()}/[^/]*", re.IGNORECASE)
+            resource_id = resource_id_pattern.match(resource_id).group(0) if resource_id_pattern.match(resource_id) else None
+
+    if dt_me_type and resource_id:
+        parsed_record["dt.source_entity"] = create_monitored_entity_id(dt_me_type, resource_id)
+        if dt_me_type == "CUSTOM_DEVICE":
+            parsed_record["dt.entity.custom_device"] = parsed_record["dt.source_entity"]
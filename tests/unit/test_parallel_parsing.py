@@ -0,0 +1,94 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import pytest
+from azure.functions import EventHubEvent
+
+from logs_ingest import main, json_codec
+from logs_ingest.self_monitoring import SelfMonitoring
+
+EVENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "integration", "events.json")
+
+
+def shutdown_parsing_executor():
+    parsing_executor = main.get_parsing_executor()
+    main.discard_parsing_executor(parsing_executor)
+    parsing_executor.shutdown()
+
+
+def create_events():
+    with open(EVENTS_PATH, encoding="utf-8") as file:
+        records = json.load(file)
+    timestamp = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    events = []
+    for i in range(10):
+        for record in records[1:]:
+            record["time"] = timestamp
+        events.append(EventHubEvent(body=json.dumps({"records": records[i % 3:]}).encode("utf-8"), enqueued_time=datetime.utcnow()))
+    events.append(EventHubEvent(body=b"{not json", enqueued_time=datetime.utcnow()))
+    events.append(EventHubEvent(body=events[0].get_body(), enqueued_time=datetime.utcnow() - timedelta(days=2)))
+    return events
+
+
+def test_parsing_in_processes_gives_same_logs(monkeypatch):
+    # Parsing processes read their configuration from the environment
+    monkeypatch.delenv("FILTER_CONFIG", raising=False)
+    events = create_events()
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    expected_logs = [json_codec.dumps(log) for log in main.extract_logs(events, self_monitoring)]
+
+    monkeypatch.setattr(main, "number_of_parsing_processes", 2)
+    monkeypatch.setattr(main, "parallel_parsing_min_events", 5)
+    parallel_self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    try:
+        logs = list(main.extract_logs(events, parallel_self_monitoring))
+    finally:
+        shutdown_parsing_executor()
+
+    assert logs == expected_logs
+    assert parallel_self_monitoring.too_old_records == self_monitoring.too_old_records > 0
+    assert parallel_self_monitoring.parsing_errors == self_monitoring.parsing_errors > 0
+    assert parallel_self_monitoring.too_long_content_size == self_monitoring.too_long_content_size
+
+
+def test_parsing_continues_after_parsing_process_dies(monkeypatch):
+    monkeypatch.delenv("FILTER_CONFIG", raising=False)
+    events = create_events()
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    expected_logs = [json_codec.dumps(log) for log in main.extract_logs(events, self_monitoring)]
+
+    monkeypatch.setattr(main, "number_of_parsing_processes", 2)
+    monkeypatch.setattr(main, "parallel_parsing_min_events", 5)
+    broken_executor = main.get_parsing_executor()
+    try:
+        with pytest.raises(BrokenProcessPool):
+            broken_executor.submit(os._exit, 1).result()
+
+        # chunks of broken pool are parsed in the function process
+        fallback_self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+        logs = [log if isinstance(log, bytes) else json_codec.dumps(log) for log in main.extract_logs(events, fallback_self_monitoring)]
+        assert logs == expected_logs
+        assert fallback_self_monitoring.too_old_records == self_monitoring.too_old_records
+        assert fallback_self_monitoring.parsing_errors == self_monitoring.parsing_errors
+
+        # next execution is parsed by new processes
+        assert main.get_parsing_executor() is not broken_executor
+        assert list(main.extract_logs(events, SelfMonitoring(execution_time=datetime.utcnow()))) == expected_logs
+    finally:
+        shutdown_parsing_executor()
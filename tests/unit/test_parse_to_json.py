@@ -12,7 +12,15 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import math
+from datetime import datetime
+
+import orjson
+import pytest
+
+from logs_ingest import json_codec
 from logs_ingest.main import parse_to_json
+from logs_ingest.self_monitoring import SelfMonitoring
 
 def test_linux_log():
 
@@ -58,3 +66,59 @@ def test_windows_log():
 
     # then
     assert json_event == expected_windows_log
+
+
+def test_json_repair_tiers_are_counted():
+    # given
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    malformed_texts = [
+        '{"message": "first line\nsecond line"}',
+        "{'message': 'single quotes'}",
+        "{'message': 'it\\'s escaped'}",
+        "{'message': 'it\\'s\tescaped'}",
+        "{'message': 'raw\ttab'}",
+    ]
+
+    # when
+    json_events = [parse_to_json(text, self_monitoring) for text in malformed_texts]
+
+    # then
+    assert json_events == [
+        {"message": "first linesecond line"},
+        {"message": "single quotes"},
+        {"message": "it\"s escaped"},
+        {"message": "its\tescaped"},
+        {"message": "raw\ttab"},
+    ]
+    assert self_monitoring.json_repairs == {"newlines_removed": 1, "single_quotes_replaced": 2, "escaped_single_quotes_removed": 2}
+    assert parse_to_json("{not json", self_monitoring) is None
+
+
+@pytest.mark.parametrize("orjson_module", [orjson, None], ids=["orjson", "json"])
+def test_json_backends_decode_like_stdlib(monkeypatch, orjson_module):
+    # given
+    monkeypatch.setattr(json_codec, "orjson", orjson_module)
+
+    # when
+    json_event = json_codec.loads('{"big": 123456789012345678901234567890, "nan": NaN, "surrogate": "\\ud800", "a": 1, "a": 2.5}')
+
+    # then
+    assert json_event["big"] == 123456789012345678901234567890
+    assert math.isnan(json_event["nan"])
+    assert json_event["surrogate"] == "\ud800"
+    assert json_event["a"] == 2.5
+
+
+def test_parse_to_json_from_bytes():
+    # given
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    body = '{"records": [{"message": "zażółć"}]}'.encode("utf-8")
+    malformed_body = "{'records': [{'message': 'zażółć'}]}".encode("utf-8")
+
+    # when
+    json_event = parse_to_json(body, self_monitoring)
+    repaired_json_event = parse_to_json(malformed_body, self_monitoring)
+
+    # then
+    assert json_event == repaired_json_event == {"records": [{"message": "zażółć"}]}
+    assert self_monitoring.json_repairs == {"single_quotes_replaced": 1}
@@ -0,0 +1,52 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+from datetime import datetime
+
+import pytest
+from azure.functions import EventHubEvent
+
+from logs_ingest import main
+from logs_ingest.self_monitoring import SelfMonitoring
+
+timestamp = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+record_text = '{"time":"' + timestamp + '","category":"SomeCategory","level":"Warning","message":"zażółć"}'
+record_with_properties_text = '{"time":"' + timestamp + '","category":"SomeCategory","properties":"{\\"message\\":\\"text\\"}"}'
+
+
+def extract_contents(body: str):
+    events = [EventHubEvent(body=body.encode("utf-8"), enqueued_time=datetime.utcnow())]
+    return [log["content"] for log in main.extract_logs(events, SelfMonitoring(execution_time=datetime.utcnow()))]
+
+
+@pytest.mark.parametrize("passthrough_enabled", [True, False])
+def test_record_content(monkeypatch, passthrough_enabled):
+    monkeypatch.setattr(main, "raw_content_passthrough_enabled", passthrough_enabled)
+
+    contents = extract_contents('{"records": [' + record_text + ', ' + record_with_properties_text + ']}')
+
+    assert [json.loads(content) for content in contents] == [json.loads(record_text), {**json.loads(record_with_properties_text),
+                                                                                          "properties": {"message": "text"}}]
+    # record is sent as it came in the event, unless its properties have been deserialized
+    assert (contents[0] == record_text) == passthrough_enabled
+    assert contents[1] == json.dumps(json.loads(contents[1]))
+
+
+def test_raw_content_passthrough_with_malformed_event(monkeypatch):
+    monkeypatch.setattr(main, "raw_content_passthrough_enabled", True)
+
+    contents = extract_contents('{"records": [' + record_text.replace('"', "'") + ']}')
+
+    assert contents == [json.dumps(json.loads(record_text))]
@@ -0,0 +1,72 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from datetime import datetime, timezone, timedelta
+
+from azure.functions import EventHubEvent
+
+from logs_ingest import main
+from logs_ingest.main import is_event_too_old, is_too_old
+from logs_ingest.self_monitoring import SelfMonitoring
+
+oldest_accepted_time = datetime(2021, 3, 15, 11, 0, 0, tzinfo=timezone.utc)
+
+
+def test_event_age_is_checked_on_enqueued_time():
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+
+    assert is_event_too_old(datetime(2021, 3, 15, 10, 59, 59), oldest_accepted_time, self_monitoring)
+    # compared with seconds precision
+    assert not is_event_too_old(datetime(2021, 3, 15, 11, 0, 0, 999999), oldest_accepted_time, self_monitoring)
+    assert not is_event_too_old(datetime(2021, 3, 15, 12, 0, 0, tzinfo=timezone.utc), oldest_accepted_time, self_monitoring)
+    assert not is_event_too_old(None, oldest_accepted_time, self_monitoring)
+    assert self_monitoring.too_old_records == 1
+
+
+def test_record_age_is_checked_on_timestamp():
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    too_old = oldest_accepted_time - timedelta(seconds=1)
+
+    assert is_too_old({"timestamp": too_old.isoformat()}, oldest_accepted_time, self_monitoring)
+    assert is_too_old({"timestamp": too_old.strftime("%m/%d/%Y %H:%M:%S")}, oldest_accepted_time, self_monitoring)
+    assert not is_too_old({"timestamp": "2021-03-15T11:00:00.0000001Z"}, oldest_accepted_time, self_monitoring)
+    assert not is_too_old({"timestamp": "not a timestamp"}, oldest_accepted_time, self_monitoring)
+    assert not is_too_old({}, oldest_accepted_time, self_monitoring)
+    assert self_monitoring.too_old_records == 2
+    assert self_monitoring.parsing_errors == 1
+
+
+def test_record_timestamp_is_normalized():
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    records = [{"timestamp": "04/05/2022 07:54:00"}, {"timestamp": "2022-04-05T07:54:00.1234567Z"}, {"timestamp": "04/05/2022 07:54:00"}]
+
+    for record in records:
+        assert not is_too_old(record, oldest_accepted_time, self_monitoring)
+
+    assert [record["timestamp"] for record in records] == ["2022-04-05T07:54:00Z", "2022-04-05T07:54:00.1234567Z", "2022-04-05T07:54:00Z"]
+
+
+def test_nothing_is_sent_when_all_events_are_too_old(monkeypatch):
+    monkeypatch.setenv(main.DYNATRACE_URL, "http://localhost")
+    monkeypatch.setenv(main.DYNATRACE_ACCESS_KEY, "token")
+    sender_calls = []
+    monkeypatch.setattr(main, "run_in_sender_loop", sender_calls.append)
+    self_monitoring = SelfMonitoring(execution_time=datetime.utcnow())
+    events = [EventHubEvent(body=b'{"records": [{"content": "log"}]}', enqueued_time=datetime.utcnow() - timedelta(days=2))]
+
+    main.process_logs(events, self_monitoring)
+
+    # no event loop nor session is set up for an execution without logs
+    assert not sender_calls
+    assert self_monitoring.too_old_records == 1
@@ -49,6 +49,53 @@ def test_self_monitoring_metrics_with_zero_values():
     assert metric_data == expected_metric_data_without_zeros_metrics
 
 
+def test_rule_cache_metrics():
+    self_monitoring = SelfMonitoring(execution_time=execution_time)
+    self_monitoring.rule_cache_hits = 98
+    self_monitoring.rule_cache_misses = 2
+
+    metric_data = self_monitoring.prepare_metric_data()
+    assert SelfMonitoring.metric_data("2021-02-25T09:06:06Z", "rule_cache_hits", 98, count=98) in metric_data
+    assert SelfMonitoring.metric_data("2021-02-25T09:06:06Z", "rule_cache_misses", 2, count=2) in metric_data
+
+
+def test_entity_id_cache_metrics():
+    self_monitoring = SelfMonitoring(execution_time=execution_time)
+    self_monitoring.entity_id_cache_hits = 40
+    self_monitoring.entity_id_cache_misses = 3
+
+    metric_data = self_monitoring.prepare_metric_data()
+
+    assert SelfMonitoring.metric_data("2021-02-25T09:06:06Z", "entity_id_cache_hits", 40, count=40) in metric_data
+    assert SelfMonitoring.metric_data("2021-02-25T09:06:06Z", "entity_id_cache_misses", 3, count=3) in metric_data
+
+
+def test_merge_parsing_statistics():
+    self_monitoring = SelfMonitoring(execution_time=execution_time)
+    self_monitoring.too_old_records = 1
+    self_monitoring.too_long_content_size = [9000]
+    self_monitoring.json_repairs["newlines_removed"] = 1
+    self_monitoring.all_requests = 3
+    parsing_process_self_monitoring = SelfMonitoring(execution_time=execution_time)
+    parsing_process_self_monitoring.too_old_records = 2
+    parsing_process_self_monitoring.parsing_errors = 3
+    parsing_process_self_monitoring.too_long_content_size = [10000]
+    parsing_process_self_monitoring.json_repairs.update({"newlines_removed": 1, "single_quotes_replaced": 4})
+    parsing_process_self_monitoring.rule_cache_hits = 5
+    parsing_process_self_monitoring.rule_cache_misses = 6
+    parsing_process_self_monitoring.entity_id_cache_hits = 7
+
+    self_monitoring.merge(parsing_process_self_monitoring)
+
+    assert self_monitoring.too_old_records == 3
+    assert self_monitoring.parsing_errors == 3
+    assert self_monitoring.too_long_content_size == [9000, 10000]
+    assert self_monitoring.json_repairs == {"newlines_removed": 2, "single_quotes_replaced": 4}
+    assert (self_monitoring.rule_cache_hits, self_monitoring.rule_cache_misses) == (5, 6)
+    assert (self_monitoring.entity_id_cache_hits, self_monitoring.entity_id_cache_misses) == (7, 0)
+    assert self_monitoring.all_requests == 3
+
+
 all_expected_metric_data = [
     {
         "time": "2021-02-25T09:06:06Z",
@@ -0,0 +1,55 @@
+#   Copyright 2026 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from datetime import datetime, timezone
+
+import pytest
+from dateutil import parser
+
+from logs_ingest.util import timestamps
+from logs_ingest.util.timestamps import parse_timestamp
+
+azure_timestamps = [
+    "2021-03-01T12:34:56Z",
+    "2021-03-01T12:34:56.1234567Z",
+    "2021-03-01T12:34:56.123Z",
+    "2021-03-01T12:34:56.1234567+02:00",
+    "2021-03-01T12:34:56.123456-0530",
+    "2021-03-01T12:34:56",
+    "2021-03-01 12:34:56.1234567",
+    "2021-03-01",
+    "03/01/2021 12:34:56",
+]
+
+
+@pytest.mark.parametrize("timestamp", azure_timestamps)
+def test_parse_timestamp_without_dateutil(monkeypatch, timestamp):
+    expected_date = parser.parse(timestamp)
+    if not expected_date.tzinfo:
+        expected_date = expected_date.replace(tzinfo=timezone.utc)
+
+    def fail(*_args, **_kwargs):
+        raise AssertionError("dateutil shouldn't be used")
+
+    monkeypatch.setattr(timestamps.parser, "parse", fail)
+
+    assert parse_timestamp(timestamp) == expected_date
+
+
+def test_parse_timestamp_falls_back_to_dateutil():
+    assert parse_timestamp("Mon, 1 Mar 2021 12:34:56 GMT") == datetime(2021, 3, 1, 12, 34, 56, tzinfo=timezone.utc)
+    assert parse_timestamp("13/01/2021 12:34:56") == datetime(2021, 1, 13, 12, 34, 56, tzinfo=timezone.utc)
+
+    with pytest.raises(ValueError):
+        parse_timestamp("not a timestamp")